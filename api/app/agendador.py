@@ -0,0 +1,77 @@
+import os
+import threading
+
+from app.database import engine
+from app.particoes_auditoria import garantir_particoes
+from app.prazos import processar_prazos
+from app.serie_temporal import processar_serie_temporal
+
+# Rotinas periódicas em segundo plano.
+# Uma thread por processo corre todas as rotinas logo no arranque e depois a cada intervalo.
+# Com vários workers, cada rotina protege-se da execução simultânea (advisory locks no
+# PostgreSQL), e a falha de uma não impede as seguintes.
+
+AGENDADOR_ATIVO = os.getenv("AGENDADOR", os.getenv("PRAZOS_AGENDADOR", "true")).lower() in ("1", "true", "sim")
+AGENDADOR_INTERVALO = float(os.getenv("AGENDADOR_INTERVALO_SEGUNDOS", os.getenv("PRAZOS_INTERVALO_SEGUNDOS", "3600")))
+
+
+def _vencer_prazos():
+    vencidas = processar_prazos()
+    if vencidas:
+        print(f"{vencidas} NC(s) marcadas como vencidas.")
+
+
+def _garantir_particoes():
+    # Mantém partições de auditoria para os próximos meses sem depender de um reinício.
+    garantir_particoes(engine)
+
+
+ROTINAS = [
+    ("prazos das NCs", _vencer_prazos),
+    ("série temporal", processar_serie_temporal),
+    ("partições de auditoria", _garantir_particoes),
+]
+
+
+class Agendador:
+    def __init__(self, intervalo: float, rotinas: list):
+        self.intervalo = intervalo
+        self.rotinas = rotinas
+        self._parar = threading.Event()
+        self._thread = None
+
+    @property
+    def ativo(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.ativo:
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="agendador", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def executar_rotinas(self):
+        for nome, rotina in self.rotinas:
+            if self._parar.is_set():
+                return
+            try:
+                rotina()
+            except Exception as e:
+                print(f"Falha na rotina agendada ({nome}): {e}")
+
+    def _executar(self):
+        # Processa logo no arranque e depois a cada intervalo.
+        while True:
+            self.executar_rotinas()
+            if self._parar.wait(self.intervalo):
+                return
+
+
+agendador = Agendador(AGENDADOR_INTERVALO, ROTINAS)
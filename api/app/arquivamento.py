@@ -0,0 +1,90 @@
+from datetime import date, datetime
+
+from sqlalchemy import delete, insert, literal, select, union_all
+from sqlalchemy.orm import Session, aliased
+
+from app import models
+
+# Arquivamento de exercícios anteriores.
+# Move as NCs encerradas ("Totalmente Empenhada" ou "Recolhida") de exercícios passados,
+# com os seus empenhos, anulações e recolhimentos, para as tabelas *_arquivo, mantendo
+# as tabelas principais dimensionadas ao exercício corrente.
+
+STATUS_ENCERRADOS = ("Totalmente Empenhada", "Recolhida")
+
+# Pares (tabela principal, tabela de arquivo), por ordem de dependência.
+_TABELAS = [
+    (models.NotaCredito, models.NotaCreditoArquivo),
+    (models.Empenho, models.EmpenhoArquivo),
+    (models.AnulacaoEmpenho, models.AnulacaoEmpenhoArquivo),
+    (models.RecolhimentoSaldo, models.RecolhimentoSaldoArquivo),
+]
+
+
+def _colunas(modelo) -> list:
+    return [c.name for c in modelo.__table__.columns]
+
+
+def arquivar_exercicio(db: Session, ano: int) -> dict:
+    """
+    Move para o arquivo as NCs encerradas com data de chegada até o fim do exercício `ano`.
+    Executa na transação da sessão recebida; o commit fica a cargo de quem chama.
+    """
+    nc_ids = [nc_id for (nc_id,) in db.query(models.NotaCredito.id).filter(
+        models.NotaCredito.status.in_(STATUS_ENCERRADOS),
+        models.NotaCredito.data_chegada < date(ano + 1, 1, 1)
+    ).with_for_update().all()]
+
+    contagem = {"notas_credito": len(nc_ids), "empenhos": 0, "anulacoes": 0, "recolhimentos": 0}
+    if not nc_ids:
+        return contagem
+
+    empenho_ids = select(models.Empenho.id).where(models.Empenho.nota_credito_id.in_(nc_ids)).scalar_subquery()
+    filtros = {
+        models.NotaCredito: models.NotaCredito.id.in_(nc_ids),
+        models.Empenho: models.Empenho.nota_credito_id.in_(nc_ids),
+        models.AnulacaoEmpenho: models.AnulacaoEmpenho.empenho_id.in_(empenho_ids),
+        models.RecolhimentoSaldo: models.RecolhimentoSaldo.nota_credito_id.in_(nc_ids),
+    }
+
+    agora = datetime.utcnow()
+    for ativo, arquivo in _TABELAS:
+        colunas = _colunas(ativo)
+        origem = select(*[ativo.__table__.c[c] for c in colunas]).where(filtros[ativo])
+        if arquivo is models.NotaCreditoArquivo:
+            colunas = colunas + ["arquivado_em"]
+            origem = origem.add_columns(literal(agora))
+        db.execute(insert(arquivo).from_select(colunas, origem))
+
+    # Remove das tabelas principais, dos filhos para os pais.
+    contagem["anulacoes"] = db.execute(delete(models.AnulacaoEmpenho).where(filtros[models.AnulacaoEmpenho])).rowcount
+    contagem["recolhimentos"] = db.execute(delete(models.RecolhimentoSaldo).where(filtros[models.RecolhimentoSaldo])).rowcount
+    contagem["empenhos"] = db.execute(delete(models.Empenho).where(filtros[models.Empenho])).rowcount
+    db.execute(delete(models.NotaCredito).where(filtros[models.NotaCredito]))
+    return contagem
+
+
+def _uniao_com_arquivo(ativo, arquivo):
+    colunas = _colunas(ativo)
+    return union_all(
+        select(*[ativo.__table__.c[c] for c in colunas]),
+        select(*[arquivo.__table__.c[c] for c in colunas]),
+    ).subquery()
+
+
+def notas_credito_com_arquivo():
+    # Entidade NotaCredito sobre a união das tabelas principal e de arquivo (somente leitura).
+    return aliased(models.NotaCredito, _uniao_com_arquivo(models.NotaCredito, models.NotaCreditoArquivo), name="notas_credito_todas")
+
+
+def empenhos_com_arquivo():
+    # Entidade Empenho sobre a união das tabelas principal e de arquivo (somente leitura).
+    return aliased(models.Empenho, _uniao_com_arquivo(models.Empenho, models.EmpenhoArquivo), name="empenhos_todos")
+
+
+def anulacoes_com_arquivo():
+    return aliased(models.AnulacaoEmpenho, _uniao_com_arquivo(models.AnulacaoEmpenho, models.AnulacaoEmpenhoArquivo), name="anulacoes_todas")
+
+
+def recolhimentos_com_arquivo():
+    return aliased(models.RecolhimentoSaldo, _uniao_com_arquivo(models.RecolhimentoSaldo, models.RecolhimentoSaldoArquivo), name="recolhimentos_todos")
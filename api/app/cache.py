@@ -0,0 +1,27 @@
+import threading
+from collections import OrderedDict
+
+# Caches de resultados de relatórios.
+# As chaves incluem sempre a versão dos dados (ver versao_dados.py), por isso uma entrada
+# nunca fica desatualizada: apenas deixa de ser consultada e acaba removida pelo LRU.
+
+
+class CacheMemoria:
+    def __init__(self, max_itens: int = 256):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            if chave not in self._itens:
+                return None
+            self._itens.move_to_end(chave)
+            return self._itens[chave]
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
@@ -0,0 +1,116 @@
+from typing import List, Optional
+
+from sqlalchemy import func, literal, null, select, union_all
+from sqlalchemy.orm import Session
+
+from app import models
+from app.arquivamento import (anulacoes_com_arquivo, empenhos_com_arquivo,
+                              notas_credito_com_arquivo, recolhimentos_com_arquivo)
+from app.cache import CacheMemoria
+from app.database import unidade_atual
+from app.dinheiro import Centavos
+from app.versao_dados import obter_versao
+
+# Execução orçamentária agrupada por PI, ND e/ou Seção.
+# Os totais por NC (empenhado, anulado, recolhido) são pré-agregados em subconsultas para
+# evitar a multiplicação de linhas nas junções; o agrupamento final é um único
+# GROUP BY ROLLUP (PostgreSQL) ou a sua emulação com UNION ALL nos restantes bancos.
+# As somas são feitas pelo banco em centavos inteiros; as linhas devolvem reais (Decimal).
+
+DIMENSOES = ("plano_interno", "nd", "secao")
+METRICAS = ("valor", "empenhado", "anulado", "recolhido", "saldo", "quantidade")
+
+_cache = CacheMemoria()
+
+
+def consultar_consolidado(
+    db: Session,
+    agrupar_por: List[str],
+    plano_interno: Optional[str] = None,
+    nd: Optional[str] = None,
+    secao_responsavel_id: Optional[int] = None,
+    status: Optional[str] = None,
+    incluir_arquivo: bool = False,
+) -> List[dict]:
+    chave = (unidade_atual.get(), tuple(agrupar_por), plano_interno, nd, secao_responsavel_id, status, incluir_arquivo, obter_versao(db))
+    linhas = _cache.get(chave)
+    if linhas is None:
+        linhas = _consultar(db, agrupar_por, plano_interno, nd, secao_responsavel_id, status, incluir_arquivo)
+        _cache.set(chave, linhas)
+    return linhas
+
+
+def consulta_consolidado(
+    db: Session,
+    agrupar_por: List[str],
+    plano_interno: Optional[str] = None,
+    nd: Optional[str] = None,
+    secao_responsavel_id: Optional[int] = None,
+    status: Optional[str] = None,
+    incluir_arquivo: bool = False,
+):
+    """O SELECT do consolidado: as dimensões de agrupar_por, as METRICAS e o nível ("nivel") do ROLLUP."""
+    if incluir_arquivo:
+        NC, E, A, R = notas_credito_com_arquivo(), empenhos_com_arquivo(), anulacoes_com_arquivo(), recolhimentos_com_arquivo()
+    else:
+        NC, E, A, R = models.NotaCredito, models.Empenho, models.AnulacaoEmpenho, models.RecolhimentoSaldo
+
+    empenhado = select(E.nota_credito_id.label("nc_id"), func.sum(E.valor).label("total")).group_by(E.nota_credito_id).subquery()
+    anulado = select(E.nota_credito_id.label("nc_id"), func.sum(A.valor).label("total")).select_from(A).join(E, A.empenho_id == E.id).group_by(E.nota_credito_id).subquery()
+    recolhido = select(R.nota_credito_id.label("nc_id"), func.sum(R.valor).label("total")).group_by(R.nota_credito_id).subquery()
+
+    colunas = {"plano_interno": NC.plano_interno, "nd": NC.nd, "secao": models.Seção.nome}
+    dimensoes = [colunas[d] for d in agrupar_por]
+    agregados = [
+        func.sum(NC.valor).label("valor"),
+        func.sum(func.coalesce(empenhado.c.total, 0)).label("empenhado"),
+        func.sum(func.coalesce(anulado.c.total, 0)).label("anulado"),
+        func.sum(func.coalesce(recolhido.c.total, 0)).label("recolhido"),
+        func.sum(NC.saldo_disponivel).label("saldo"),
+        func.count(NC.id).label("quantidade"),
+    ]
+
+    def base(*colunas_select):
+        stmt = select(*colunas_select).select_from(NC) \
+            .outerjoin(models.Seção, NC.secao_responsavel_id == models.Seção.id) \
+            .outerjoin(empenhado, empenhado.c.nc_id == NC.id) \
+            .outerjoin(anulado, anulado.c.nc_id == NC.id) \
+            .outerjoin(recolhido, recolhido.c.nc_id == NC.id)
+        if plano_interno: stmt = stmt.where(NC.plano_interno.ilike(f"%{plano_interno}%"))
+        if nd: stmt = stmt.where(NC.nd.ilike(f"%{nd}%"))
+        if secao_responsavel_id: stmt = stmt.where(NC.secao_responsavel_id == secao_responsavel_id)
+        if status: stmt = stmt.where(NC.status == status)
+        return stmt
+
+    if db.get_bind().dialect.name == "postgresql":
+        stmt = base(*[c.label(d) for c, d in zip(dimensoes, agrupar_por)], *agregados, func.grouping(*dimensoes).label("nivel")) \
+            .group_by(func.rollup(*dimensoes)) \
+            .order_by(*[c.asc().nulls_last() for c in dimensoes])
+    else:
+        # Emulação do ROLLUP: um ramo por prefixo das dimensões, do mais detalhado ao total geral.
+        ramos = []
+        for n in range(len(dimensoes), -1, -1):
+            selecao = [c.label(d) if i < n else null().label(d) for i, (c, d) in enumerate(zip(dimensoes, agrupar_por))]
+            # Mesma máscara que o GROUPING() do PostgreSQL: um bit por dimensão totalizada.
+            ramo = base(*selecao, *agregados, literal((1 << (len(dimensoes) - n)) - 1).label("nivel"))
+            if n:
+                ramo = ramo.group_by(*dimensoes[:n])
+            ramos.append(ramo)
+        uniao = union_all(*ramos).subquery()
+        stmt = select(uniao).order_by(*[uniao.c[d].asc().nulls_last() for d in agrupar_por], uniao.c.nivel)
+    return stmt
+
+
+def _consultar(db, agrupar_por, plano_interno, nd, secao_responsavel_id, status, incluir_arquivo):
+    stmt = consulta_consolidado(db, agrupar_por, plano_interno, nd, secao_responsavel_id, status, incluir_arquivo)
+    linhas = []
+    for row in db.execute(stmt):
+        dados = row._mapping
+        linha = {d: dados[d] for d in agrupar_por}
+        linha["subtotal"] = bool(dados["nivel"])
+        # Dimensões totalizadas (as últimas de agrupar_por); uma dimensão nula fora desta lista é um valor em falta.
+        linha["totalizadas"] = agrupar_por[len(agrupar_por) - bin(dados["nivel"]).count("1"):]
+        linha.update({m: Centavos(dados[m] or 0).reais for m in METRICAS if m != "quantidade"})
+        linha["quantidade"] = dados["quantidade"] or 0
+        linhas.append(linha)
+    return linhas
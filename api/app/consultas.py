@@ -0,0 +1,157 @@
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import desc, func, select
+from sqlalchemy.orm import Query, Session, contains_eager, joinedload
+
+from app import models
+from app.arquivamento import empenhos_com_arquivo, notas_credito_com_arquivo
+from app.prazos import STATUS_ATIVA
+
+# Consultas das listagens, exclusões, painel e relatórios.
+# Os routers executam-nas (com a paginação de cada endpoint) e o verificador de planos
+# (ver planos_consulta.py) corre EXPLAIN sobre as mesmas, pelo que um índice em falta
+# ou uma alteração que degrade o plano é detetada na consulta que chega ao banco.
+
+
+def listar_notas_credito(
+    db: Session,
+    numero_nc: Optional[str] = None,
+    plano_interno: Optional[str] = None,
+    nd: Optional[str] = None,
+    secao_responsavel_id: Optional[int] = None,
+    status: Optional[str] = None,
+    incluir_arquivo: bool = False,
+) -> Query:
+    NC = notas_credito_com_arquivo() if incluir_arquivo else models.NotaCredito
+    query = db.query(NC).options(joinedload(NC.secao_responsavel))
+    if numero_nc: query = query.filter(NC.numero_nc.ilike(f"%{numero_nc}%"))
+    if plano_interno: query = query.filter(NC.plano_interno.ilike(f"%{plano_interno}%"))
+    if nd: query = query.filter(NC.nd.ilike(f"%{nd}%"))
+    if secao_responsavel_id: query = query.filter(NC.secao_responsavel_id == secao_responsavel_id)
+    if status: query = query.filter(NC.status == status)
+    return query.order_by(desc(NC.data_chegada))
+
+
+def listar_empenhos(
+    db: Session,
+    nota_credito_id: Optional[int] = None,
+    numero_ne: Optional[str] = None,
+    incluir_arquivo: bool = False,
+) -> Query:
+    if incluir_arquivo:
+        E, NC = empenhos_com_arquivo(), notas_credito_com_arquivo()
+        query = db.query(E).join(NC, E.nota_credito_id == NC.id).options(
+            joinedload(E.secao_requisitante),
+            contains_eager(E.nota_credito.of_type(NC)).joinedload(NC.secao_responsavel)
+        )
+    else:
+        E = models.Empenho
+        query = db.query(E).options(
+            joinedload(E.secao_requisitante),
+            joinedload(E.nota_credito).joinedload(models.NotaCredito.secao_responsavel)
+        )
+    if nota_credito_id:
+        query = query.filter(E.nota_credito_id == nota_credito_id)
+    if numero_ne:
+        query = query.filter(E.numero_ne.ilike(f"%{numero_ne}%"))
+    return query.order_by(desc(E.data_empenho))
+
+
+def listar_anulacoes(db: Session, empenho_id: int) -> Query:
+    A = models.AnulacaoEmpenho
+    return db.query(A).join(A.empenho).filter(A.empenho_id == empenho_id).order_by(A.data)
+
+
+def listar_recolhimentos(db: Session, nota_credito_id: int) -> Query:
+    R = models.RecolhimentoSaldo
+    return db.query(R).join(R.nota_credito).filter(R.nota_credito_id == nota_credito_id).order_by(R.data)
+
+
+def listar_auditoria(db: Session, data_inicio: Optional[date] = None, data_fim: Optional[date] = None) -> Query:
+    # Os limites em timestamp restringem a leitura às partições do período.
+    query = db.query(models.AuditLog)
+    if data_inicio:
+        query = query.filter(models.AuditLog.timestamp >= datetime.combine(data_inicio, datetime.min.time()))
+    if data_fim:
+        query = query.filter(models.AuditLog.timestamp < datetime.combine(data_fim + timedelta(days=1), datetime.min.time()))
+    return query.order_by(desc(models.AuditLog.timestamp))
+
+
+# --- Exclusões: registos dependentes que impedem a exclusão ---
+
+def empenhos_da_nota_credito(db: Session, nc_id: int) -> Query:
+    return db.query(models.Empenho.id).filter(models.Empenho.nota_credito_id == nc_id)
+
+
+def anulacoes_do_empenho(db: Session, empenho_id: int) -> Query:
+    return db.query(models.AnulacaoEmpenho.id).filter(models.AnulacaoEmpenho.empenho_id == empenho_id)
+
+
+def vinculos_da_secao(db: Session, secao_id: int) -> List[Tuple[str, Query]]:
+    """Consultas dos registos vinculados à seção, com o vínculo usado na mensagem de erro."""
+    return [
+        ("Notas de Crédito", db.query(models.NotaCredito.id).filter(models.NotaCredito.secao_responsavel_id == secao_id)),
+        ("Empenhos", db.query(models.Empenho.id).filter(models.Empenho.secao_requisitante_id == secao_id)),
+        ("registos arquivados", db.query(models.NotaCreditoArquivo.id).filter(models.NotaCreditoArquivo.secao_responsavel_id == secao_id)),
+        ("registos arquivados", db.query(models.EmpenhoArquivo.id).filter(models.EmpenhoArquivo.secao_requisitante_id == secao_id)),
+    ]
+
+
+# --- Painel ---
+
+def consultas_kpis(db: Session) -> dict:
+    """Uma consulta escalar por indicador do painel."""
+    NC = models.NotaCredito
+    return {
+        "saldo_disponivel": db.query(func.sum(NC.saldo_disponivel)),
+        "ncs_ativas": db.query(func.count(NC.id)).filter(NC.status == STATUS_ATIVA),
+        "empenhado": db.query(func.sum(models.Empenho.valor)),
+        "anulado": db.query(func.sum(models.AnulacaoEmpenho.valor)).join(models.AnulacaoEmpenho.empenho),
+    }
+
+
+# --- Relatório PDF ---
+
+def filtrar_ncs(query: Query, modelo, plano_interno=None, nd=None, secao_responsavel_id=None, status=None) -> Query:
+    if plano_interno: query = query.filter(modelo.plano_interno.ilike(f"%{plano_interno}%"))
+    if nd: query = query.filter(modelo.nd.ilike(f"%{nd}%"))
+    if secao_responsavel_id: query = query.filter(modelo.secao_responsavel_id == secao_responsavel_id)
+    if status: query = query.filter(modelo.status.ilike(f"%{status}%"))
+    return query
+
+
+def impressao_digital_relatorio(db: Session, modelo, incluir_detalhes: bool, **filtros) -> Query:
+    """
+    Colunas impressas no relatório de NCs e, com detalhes, a contagem, a soma e o maior id
+    dos empenhos e recolhimentos de cada NC: identificam o conteúdo do PDF em cache.
+    """
+    colunas = [modelo.id, modelo.numero_nc, modelo.plano_interno, modelo.nd, modelo.valor, modelo.saldo_disponivel,
+               modelo.status, modelo.prazo_empenho, models.Seção.nome]
+    totais = []
+    if incluir_detalhes:
+        # Pré-agregados por NC numa única passagem, em vez de subconsultas correlacionadas por linha,
+        # e só das NCs abrangidas pelos filtros.
+        ncs = filtrar_ncs(select(modelo.id), modelo, **filtros)
+        for relacao in (modelo.empenhos, modelo.recolhimentos):
+            filho = relacao.property.mapper.class_
+            total = select(
+                filho.nota_credito_id.label("nc_id"), func.count(filho.id).label("quantidade"),
+                func.sum(filho.valor).label("soma"), func.max(filho.id).label("maior_id"),
+            ).where(filho.nota_credito_id.in_(ncs)).group_by(filho.nota_credito_id).subquery()
+            colunas += [func.coalesce(total.c.quantidade, 0), total.c.soma, total.c.maior_id]
+            totais.append(total)
+    query = db.query(*colunas).outerjoin(modelo.secao_responsavel)
+    for total in totais:
+        query = query.outerjoin(total, total.c.nc_id == modelo.id)
+    query = query.order_by(modelo.plano_interno, modelo.id)
+    return filtrar_ncs(query, modelo, **filtros)
+
+
+def ncs_do_relatorio(db: Session, modelo, **filtros) -> Query:
+    query = db.query(modelo).options(
+        joinedload(modelo.secao_responsavel),
+        joinedload(modelo.empenhos),
+        joinedload(modelo.recolhimentos)
+    ).order_by(modelo.plano_interno, modelo.id)
+    return filtrar_ncs(query, modelo, **filtros)
@@ -1,6 +1,12 @@
+import itertools
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+import threading
+import time
+from contextvars import ContextVar
+from typing import NamedTuple, Optional
+from fastapi import Request, Response
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,22 +15,139 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("FATAL: A variável de ambiente DATABASE_URL não está configurada.")
 
-# Pequena correção para compatibilidade com o Heroku/Render que usam "postgres://"
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+def _normalizar_url(url: str) -> str:
+    # Pequena correção para compatibilidade com o Heroku/Render que usam "postgres://"
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    return url
+
+DATABASE_URL = _normalizar_url(DATABASE_URL)
+
+# Réplicas de leitura opcionais, separadas por vírgula (ex.: "postgresql://replica1/db,postgresql://replica2/db").
+DATABASE_READ_URLS = [_normalizar_url(u.strip()) for u in os.getenv("DATABASE_READ_URLS", "").split(",") if u.strip()]
+# Segundos durante os quais um cliente que acabou de escrever lê do primário (read-your-writes).
+READ_PIN_SECONDS = int(os.getenv("READ_PIN_SECONDS", "10"))
+# Intervalo entre verificações de saúde de uma réplica e tempo de afastamento após uma falha.
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+# Tempo máximo de ligação a uma réplica: a verificação de saúde corre no pedido e não pode ficar à espera.
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
 
 engine = create_engine(DATABASE_URL)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# --- Multiunidade ---
+# A unidade do pedido corrente é definida na autenticação (ver unidades.py). Os modelos
+# marcados com __por_unidade__ podem ficar num schema ou banco próprio da unidade; os
+# restantes (utilizadores, unidades, controlo) ficam sempre no banco principal.
+
+class UnidadeContexto(NamedTuple):
+    id: int
+    schema: Optional[str] = None
+    database_url: Optional[str] = None
+
+unidade_atual: ContextVar[Optional[UnidadeContexto]] = ContextVar("unidade_atual", default=None)
+
+_engines_unidade = {}
+_lock_engines = threading.Lock()
+
+def engine_da_unidade(unidade: UnidadeContexto):
+    if not (unidade.schema or unidade.database_url):
+        return None
+    chave = (unidade.schema, unidade.database_url)
+    with _lock_engines:
+        if chave not in _engines_unidade:
+            base = create_engine(_normalizar_url(unidade.database_url)) if unidade.database_url else engine
+            _engines_unidade[chave] = base.execution_options(schema_translate_map={None: unidade.schema}) if unidade.schema else base
+        return _engines_unidade[chave]
+
+class SessaoPorUnidade(Session):
+    def get_bind(self, mapper=None, clause=None, **kw):
+        unidade = self.info.get("unidade", unidade_atual.get())
+        # O mapper pode chegar como Mapper ou como a própria classe mapeada.
+        if unidade is not None and mapper is not None and getattr(getattr(mapper, "class_", mapper), "__por_unidade__", False):
+            bind = engine_da_unidade(unidade)
+            if bind is not None:
+                return bind
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+SessionLocal = sessionmaker(class_=SessaoPorUnidade, autocommit=False, autoflush=False, bind=engine)
 
 class Base(DeclarativeBase):
     pass
 
+def _argumentos_ligacao(url: str) -> dict:
+    # Só o PostgreSQL liga por rede; o SQLite abre o ficheiro local (usado para testes).
+    if make_url(url).get_backend_name() == "postgresql":
+        return {"connect_timeout": REPLICA_CONNECT_TIMEOUT}
+    return {}
+
+class _Replicas:
+    # Distribui as leituras pelas réplicas em round-robin, saltando as que falharam
+    # na última verificação de saúde até passar REPLICA_RETRY_SECONDS.
+    def __init__(self, urls):
+        self.engines = [create_engine(url, pool_pre_ping=True, connect_args=_argumentos_ligacao(url)) for url in urls]
+        self.sessoes = [sessionmaker(class_=SessaoPorUnidade, autocommit=False, autoflush=False, bind=e) for e in self.engines]
+        self._proxima = itertools.count()
+        self._verificada_em = [0.0] * len(urls)
+        self._indisponivel_ate = [0.0] * len(urls)
+        self._lock = threading.Lock()
+
+    def _saudavel(self, i: int) -> bool:
+        agora = time.monotonic()
+        if agora < self._indisponivel_ate[i]:
+            return False
+        if agora - self._verificada_em[i] < REPLICA_HEALTH_INTERVAL:
+            return True
+        try:
+            with self.engines[i].connect() as conn:
+                conn.execute(text("SELECT 1"))
+            self._verificada_em[i] = agora
+            return True
+        except Exception as e:
+            print(f"Réplica de leitura {i} indisponível: {e}")
+            self._indisponivel_ate[i] = agora + REPLICA_RETRY_SECONDS
+            return False
+
+    def escolher(self):
+        for _ in range(len(self.sessoes)):
+            with self._lock:
+                i = next(self._proxima) % len(self.sessoes)
+            if self._saudavel(i):
+                return self.sessoes[i]
+        return None
+
+replicas = _Replicas(DATABASE_READ_URLS)
+
+# Cookie que fixa o cliente no primário logo após uma escrita.
+COOKIE_LEITURA_PRIMARIO = "salc_leitura_primario"
+
+def fixar_no_primario(response: Response):
+    ate = time.time() + READ_PIN_SECONDS
+    response.set_cookie(COOKIE_LEITURA_PRIMARIO, f"{ate:.0f}", max_age=READ_PIN_SECONDS, httponly=True, samesite="lax")
+
+def _fixado_no_primario(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(COOKIE_LEITURA_PRIMARIO, 0)) > time.time()
+    except ValueError:
+        return False
+
 # Função de dependência para ser usada nos endpoints.
 # Garante que cada requisição tenha sua própria sessão de banco de dados
 # e que a conexão seja fechada ao final.
 def get_db():
     db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Dependência para endpoints somente leitura: usa uma réplica saudável, se houver,
+# exceto para clientes que escreveram há menos de READ_PIN_SECONDS.
+def get_read_db(request: Request):
+    fabrica = None
+    if replicas.sessoes and not _fixado_no_primario(request):
+        fabrica = replicas.escolher()
+    db = (fabrica or SessionLocal)()
     try:
         yield db
     finally:
@@ -0,0 +1,144 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Annotated
+
+from pydantic import AfterValidator, BeforeValidator, PlainSerializer, WithJsonSchema
+from sqlalchemy import BigInteger, Float, inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.types import TypeDecorator
+
+from app.migracoes import em_cada_armazenamento, is_postgres, migracao
+
+# Valores monetários em centavos inteiros.
+# No banco, as colunas de dinheiro são BIGINT em centavos (tipo Dinheiro), pelo que somas,
+# ROLLUPs e comparações de saldo são aritmética inteira exata, feita pelo próprio banco.
+# Em Python, os valores são Centavos (um int); na API continuam a ser números em reais
+# (tipo Reais dos schemas), arredondados ao centavo na entrada.
+
+
+class Centavos(int):
+    """Quantia em centavos. Soma e subtração preservam o tipo; a formatação é em reais."""
+
+    @classmethod
+    def de_reais(cls, valor) -> "Centavos":
+        # Floats passam por str para usar a representação decimal curta (0.1 -> "0.1").
+        quantia = Decimal(str(valor)) if isinstance(valor, float) else Decimal(valor)
+        return cls(int((quantia * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+
+    @property
+    def reais(self) -> Decimal:
+        return Decimal(int(self)).scaleb(-2)
+
+    def __add__(self, outro):
+        return Centavos(int(self) + outro) if isinstance(outro, int) else NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, outro):
+        return Centavos(int(self) - outro) if isinstance(outro, int) else NotImplemented
+
+    def __rsub__(self, outro):
+        return Centavos(outro - int(self)) if isinstance(outro, int) else NotImplemented
+
+    def __neg__(self):
+        return Centavos(-int(self))
+
+    def __format__(self, formato: str) -> str:
+        # f"R$ {valor:,.2f}" formata os reais, não os centavos.
+        return format(self.reais, formato)
+
+
+class Dinheiro(TypeDecorator):
+    """Coluna BIGINT em centavos; os valores lidos são Centavos."""
+
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, valor, dialect):
+        if valor is None:
+            return None
+        if isinstance(valor, bool) or not isinstance(valor, int):
+            raise TypeError(f"Valor monetário deve ser Centavos, não {type(valor).__name__}.")
+        return int(valor)
+
+    def process_result_value(self, valor, dialect):
+        # Colunas convertidas no SQLite mantêm a afinidade REAL (ver migração 6).
+        return None if valor is None else Centavos(int(round(valor)))
+
+
+# Limite de cada valor recebido pela API (R$ 10 trilhões): bem abaixo do BIGINT, para que
+# as somas do banco (saldos, consolidado, série temporal) também não transbordem.
+VALOR_MAXIMO = Centavos(10 ** 15)
+
+
+def _centavos_da_api(valor):
+    if isinstance(valor, Centavos):
+        return valor
+    if isinstance(valor, bool):
+        raise ValueError("Valor monetário inválido.")
+    try:
+        centavos = Centavos.de_reais(valor)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError("Valor monetário inválido.")
+    if abs(centavos) > VALOR_MAXIMO:
+        raise ValueError(f"O valor não pode exceder R$ {VALOR_MAXIMO:,.2f}.")
+    return centavos
+
+
+def _positivo(valor: int) -> int:
+    # Validado aqui, e não com Field(gt=0), para que o erro fale em reais e não em centavos.
+    if valor <= 0:
+        raise ValueError("O valor deve ser maior que zero.")
+    return valor
+
+
+# Campo monetário dos schemas: recebe e devolve reais no JSON, guarda Centavos no modelo.
+Reais = Annotated[
+    int,
+    BeforeValidator(_centavos_da_api),
+    AfterValidator(Centavos),
+    PlainSerializer(lambda valor: float(Centavos(valor).reais), return_type=float, when_used="json"),
+    WithJsonSchema({"type": "number", "description": "Valor em reais, com até duas casas decimais"}),
+]
+
+# Valores de lançamentos (NC, empenho, anulação, recolhimento): estritamente positivos.
+ReaisPositivo = Annotated[
+    Reais,
+    AfterValidator(_positivo),
+    WithJsonSchema({"type": "number", "exclusiveMinimum": 0, "description": "Valor em reais, com até duas casas decimais"}),
+]
+
+
+COLUNAS_MONETARIAS = {
+    "notas_credito": ("valor", "saldo_disponivel"),
+    "empenhos": ("valor",),
+    "anulacoes_empenho": ("valor",),
+    "recolhimentos_saldo": ("valor",),
+    "notas_credito_arquivo": ("valor", "saldo_disponivel"),
+    "empenhos_arquivo": ("valor",),
+    "anulacoes_empenho_arquivo": ("valor",),
+    "recolhimentos_saldo_arquivo": ("valor",),
+    "execucao_diaria": ("recebido", "empenhado", "anulado", "recolhido"),
+}
+
+
+def _converter_para_centavos(conn: Connection, esquema=None):
+    # Só converte colunas ainda em ponto flutuante: tabelas criadas depois já são BIGINT.
+    inspetor = inspect(conn)
+    prefixo = f'"{esquema}".' if esquema else ""
+    for tabela, colunas in COLUNAS_MONETARIAS.items():
+        if not inspetor.has_table(tabela, schema=esquema):
+            continue
+        tipos = {c["name"]: c["type"] for c in inspetor.get_columns(tabela, schema=esquema)}
+        for coluna in colunas:
+            if not isinstance(tipos.get(coluna), Float):
+                continue
+            if is_postgres(conn):
+                conn.execute(text(f"ALTER TABLE {prefixo}{tabela} ALTER COLUMN {coluna} TYPE BIGINT USING ROUND({coluna} * 100)::BIGINT"))
+            else:
+                # O SQLite não altera o tipo da coluna; os valores passam a centavos inteiros.
+                conn.execute(text(f"UPDATE {prefixo}{tabela} SET {coluna} = CAST(ROUND({coluna} * 100) AS INTEGER)"))
+
+
+@migracao(6, "valores monetários em centavos inteiros")
+def converter_para_centavos(conn: Connection):
+    em_cada_armazenamento(conn, _converter_para_centavos)
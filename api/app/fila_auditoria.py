@@ -0,0 +1,131 @@
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app import models
+from app.database import SessionLocal, unidade_atual
+
+# Modo write-behind do log de auditoria.
+# Quando ativado (AUDIT_WRITE_BEHIND=true), os eventos não-estritos vão para uma fila
+# em memória e são gravados em lotes (INSERT multi-linha) por tamanho ou por intervalo.
+# Eventos estritos (mutações financeiras) continuam na transação de quem os regista.
+# Um lote que falha a gravação volta a ser tentado nos ciclos seguintes, antes dos novos
+# eventos, até AUDIT_MAX_TENTATIVAS vezes; só então é descartado (e registado no log).
+
+AUDIT_WRITE_BEHIND = os.getenv("AUDIT_WRITE_BEHIND", "false").lower() in ("1", "true", "sim")
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "2.0"))
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+AUDIT_MAX_TENTATIVAS = int(os.getenv("AUDIT_MAX_TENTATIVAS", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class FilaAuditoria:
+    def __init__(self, batch_size: int, flush_interval: float, max_size: int, max_tentativas: int = AUDIT_MAX_TENTATIVAS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_tentativas = max_tentativas
+        self._fila = queue.Queue(maxsize=max_size)
+        # Lotes cuja gravação falhou: [tentativas, lote], pela ordem original.
+        self._falhados = deque()
+        self._lote_cheio = threading.Event()
+        self._parar = threading.Event()
+        self._lock_gravacao = threading.Lock()
+        self._thread = None
+
+    @property
+    def ativa(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.ativa:
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="fila-auditoria", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Encerra a thread e grava tudo o que ainda estiver na fila.
+        self._parar.set()
+        self._lote_cheio.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if not self.flush():
+            # Último recurso ao desligar: os eventos que não foi possível gravar ficam no log.
+            pendentes = [evento for _, lote in self._falhados for evento in lote]
+            self._falhados.clear()
+            while not self._fila.empty():
+                pendentes.append(self._fila.get_nowait())
+            logger.error("%d eventos de auditoria não gravados ao desligar: %s", len(pendentes), pendentes)
+
+    def put(self, username: str, action: str, details: str = None):
+        unidade = unidade_atual.get()
+        evento = {"timestamp": datetime.utcnow(), "username": username, "action": action, "details": details,
+                  "unidade_id": unidade.id if unidade else None}
+        try:
+            self._fila.put_nowait(evento)
+        except queue.Full:
+            # Fila cheia: grava um lote de forma síncrona em vez de descartar eventos.
+            self.flush()
+            self._fila.put(evento)
+        if self._fila.qsize() >= self.batch_size:
+            self._lote_cheio.set()
+
+    def flush(self) -> bool:
+        """Grava os lotes pendentes e a fila; pára no primeiro lote que falhar. Devolve True se esvaziou tudo."""
+        with self._lock_gravacao:
+            while self._falhados:
+                tentativas, lote = self._falhados[0]
+                if not self._gravar(lote):
+                    self._registar_falha(tentativas + 1)
+                    return False
+                self._falhados.popleft()
+            while True:
+                lote = []
+                while len(lote) < self.batch_size:
+                    try:
+                        lote.append(self._fila.get_nowait())
+                    except queue.Empty:
+                        break
+                if not lote:
+                    return True
+                if not self._gravar(lote):
+                    # O banco está indisponível: o lote aguarda o próximo ciclo.
+                    self._falhados.append([1, lote])
+                    return False
+
+    def _registar_falha(self, tentativas: int):
+        if tentativas < self.max_tentativas:
+            self._falhados[0][0] = tentativas
+            return
+        _, lote = self._falhados.popleft()
+        logger.error("Lote de %d eventos de auditoria descartado após %d tentativas: %s", len(lote), tentativas, lote)
+
+    def _gravar(self, lote: list) -> bool:
+        db = SessionLocal()
+        try:
+            db.execute(insert(models.AuditLog).values(lote))
+            db.commit()
+            return True
+        except Exception:
+            db.rollback()
+            logger.warning("Falha ao gravar lote de %d eventos de auditoria; nova tentativa no próximo ciclo.", len(lote), exc_info=True)
+            return False
+        finally:
+            db.close()
+
+    def _executar(self):
+        while not self._parar.is_set():
+            self._lote_cheio.wait(self.flush_interval)
+            self._lote_cheio.clear()
+            self.flush()
+
+
+fila_auditoria = FilaAuditoria(AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_QUEUE_MAX)
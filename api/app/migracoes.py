@@ -0,0 +1,70 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select, text
+from sqlalchemy.engine import Connection, Engine
+
+# Migrações versionadas do esquema.
+# O create_all do arranque só cria tabelas que não existem; alterações em tabelas
+# existentes (particionamento, índices, conversões de dados) são registadas aqui
+# com um número de versão e aplicadas uma única vez, por ordem.
+
+_metadata = MetaData()
+
+schema_versao = Table(
+    "schema_versao", _metadata,
+    Column("versao", Integer, primary_key=True),
+    Column("descricao", String, nullable=False),
+    Column("aplicada_em", DateTime, nullable=False),
+)
+
+# Chave do advisory lock que impede dois workers de migrarem em simultâneo (PostgreSQL).
+_LOCK_MIGRACOES = 4_002_001
+
+MIGRACOES = []
+
+
+def migracao(versao: int, descricao: str):
+    def registar(func):
+        MIGRACOES.append((versao, descricao, func))
+        MIGRACOES.sort(key=lambda m: m[0])
+        return func
+    return registar
+
+
+def is_postgres(conn: Connection) -> bool:
+    return conn.dialect.name == "postgresql"
+
+
+def em_cada_armazenamento(conn: Connection, alteracao):
+    """
+    Aplica alteracao(conn, esquema) ao banco principal e a cada unidade com schema ou banco
+    próprio (ver unidades.py). Bancos próprios são alterados numa transação à parte.
+    """
+    from app.database import UnidadeContexto, engine_da_unidade
+
+    alteracao(conn, None)
+    for unidade_id, esquema, database_url in conn.execute(
+        text("SELECT id, esquema, database_url FROM unidades WHERE esquema IS NOT NULL OR database_url IS NOT NULL")
+    ).all():
+        if database_url:
+            with engine_da_unidade(UnidadeContexto(unidade_id, None, database_url)).begin() as conn_unidade:
+                alteracao(conn_unidade, esquema if is_postgres(conn_unidade) else None)
+        elif is_postgres(conn):
+            alteracao(conn, esquema)
+
+
+def aplicar_migracoes(engine: Engine):
+    # Importa os módulos que registam migrações.
+    from app import dinheiro, particoes_auditoria, planos_consulta, serie_temporal, unidades, versao_dados  # noqa: F401
+
+    _metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        if is_postgres(conn):
+            conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {"chave": _LOCK_MIGRACOES})
+        aplicadas = set(conn.execute(select(schema_versao.c.versao)).scalars())
+        for versao, descricao, func in MIGRACOES:
+            if versao in aplicadas:
+                continue
+            print(f"A aplicar migração {versao}: {descricao}")
+            func(conn)
+            conn.execute(schema_versao.insert().values(versao=versao, descricao=descricao, aplicada_em=datetime.utcnow()))
@@ -1,9 +1,10 @@
 import enum
 from datetime import datetime
-from sqlalchemy import (Column, Integer, String, Float, Date, ForeignKey, 
-                        DateTime, Enum as SQLAlchemyEnum)
+from sqlalchemy import (Column, Integer, String, Date, ForeignKey, 
+                        DateTime, Index, UniqueConstraint, Enum as SQLAlchemyEnum)
 from sqlalchemy.orm import relationship
 from .database import Base
+from .dinheiro import Dinheiro
 
 # Modelos do Banco de Dados (SQLAlchemy)
 
@@ -11,6 +12,19 @@ class UserRole(str, enum.Enum):
     OPERADOR = "OPERADOR"
     ADMINISTRADOR = "ADMINISTRADOR"
 
+# Multiunidade: os modelos com unidade_id são filtrados automaticamente pela unidade do
+# utilizador (ver unidades.py). Os marcados com __por_unidade__ podem residir num schema ou
+# banco próprio da unidade e, por isso, não têm chave estrangeira para "unidades".
+
+class Unidade(Base):
+    __tablename__ = "unidades"
+    id = Column(Integer, primary_key=True, index=True)
+    sigla = Column(String, unique=True, nullable=False)
+    nome = Column(String, nullable=False)
+    cabecalho = Column(String, nullable=True) # Cabeçalho dos relatórios (linhas separadas por <br/>)
+    esquema = Column(String, nullable=True)
+    database_url = Column(String, nullable=True)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -18,19 +32,30 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     role = Column(SQLAlchemyEnum(UserRole), nullable=False, default=UserRole.OPERADOR)
+    unidade_id = Column(Integer, ForeignKey("unidades.id", ondelete="RESTRICT"), index=True, nullable=True) # Nulo: acesso a todas as unidades
 
 class Seção(Base):
     __tablename__ = "secoes"
+    __por_unidade__ = True
+    __table_args__ = (UniqueConstraint("unidade_id", "nome", name="uq_secoes_unidade_nome"),)
     id = Column(Integer, primary_key=True, index=True)
-    nome = Column(String, unique=True, nullable=False)
+    nome = Column(String, nullable=False)
+    unidade_id = Column(Integer, nullable=True)
     notas_credito = relationship("NotaCredito", back_populates="secao_responsavel")
     empenhos = relationship("Empenho", back_populates="secao_requisitante")
 
 class NotaCredito(Base):
     __tablename__ = "notas_credito"
+    __por_unidade__ = True
+    __table_args__ = (
+        Index("ix_notas_credito_unidade_data_chegada", "unidade_id", "data_chegada"),
+        Index("ix_notas_credito_unidade_status_prazo", "unidade_id", "status", "prazo_empenho"),
+        Index("ix_notas_credito_status_prazo_empenho", "status", "prazo_empenho"),
+        UniqueConstraint("unidade_id", "numero_nc", name="uq_notas_credito_unidade_numero_nc"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    numero_nc = Column(String, unique=True, nullable=False, index=True)
-    valor = Column(Float, nullable=False)
+    numero_nc = Column(String, nullable=False, index=True)
+    valor = Column(Dinheiro, nullable=False)
     esfera = Column(String)
     fonte = Column(String(10))
     ptres = Column(String(6))
@@ -40,8 +65,9 @@ class NotaCredito(Base):
     prazo_empenho = Column(Date)
     descricao = Column(String, nullable=True)
     secao_responsavel_id = Column(Integer, ForeignKey("secoes.id", ondelete="RESTRICT"), index=True)
-    saldo_disponivel = Column(Float, nullable=False)
-    status = Column(String, default="Ativa", index=True)
+    saldo_disponivel = Column(Dinheiro, nullable=False)
+    status = Column(String, default="Ativa")
+    unidade_id = Column(Integer, nullable=True)
 
     secao_responsavel = relationship("Seção", back_populates="notas_credito")
     empenhos = relationship("Empenho", back_populates="nota_credito", cascade="all, delete-orphan", passive_deletes=True)
@@ -49,13 +75,19 @@ class NotaCredito(Base):
 
 class Empenho(Base):
     __tablename__ = "empenhos"
+    __por_unidade__ = True
+    __table_args__ = (
+        Index("ix_empenhos_unidade_data_empenho", "unidade_id", "data_empenho"),
+        UniqueConstraint("unidade_id", "numero_ne", name="uq_empenhos_unidade_numero_ne"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    numero_ne = Column(String, unique=True, nullable=False, index=True)
-    valor = Column(Float, nullable=False)
+    numero_ne = Column(String, nullable=False, index=True)
+    valor = Column(Dinheiro, nullable=False)
     data_empenho = Column(Date)
     observacao = Column(String, nullable=True)
-    nota_credito_id = Column(Integer, ForeignKey("notas_credito.id", ondelete="CASCADE"))
-    secao_requisitante_id = Column(Integer, ForeignKey("secoes.id", ondelete="RESTRICT"))
+    nota_credito_id = Column(Integer, ForeignKey("notas_credito.id", ondelete="CASCADE"), index=True)
+    secao_requisitante_id = Column(Integer, ForeignKey("secoes.id", ondelete="RESTRICT"), index=True)
+    unidade_id = Column(Integer, nullable=True)
 
     nota_credito = relationship("NotaCredito", back_populates="empenhos")
     secao_requisitante = relationship("Seção", back_populates="empenhos")
@@ -63,9 +95,11 @@ class Empenho(Base):
 
 class AnulacaoEmpenho(Base):
     __tablename__ = "anulacoes_empenho"
+    __por_unidade__ = True
+    __table_args__ = (Index("ix_anulacoes_empenho_empenho_id_data", "empenho_id", "data"),)
     id = Column(Integer, primary_key=True, index=True)
     empenho_id = Column(Integer, ForeignKey("empenhos.id", ondelete="CASCADE"))
-    valor = Column(Float, nullable=False)
+    valor = Column(Dinheiro, nullable=False)
     data = Column(Date, nullable=False)
     observacao = Column(String, nullable=True)
 
@@ -73,18 +107,131 @@ class AnulacaoEmpenho(Base):
 
 class RecolhimentoSaldo(Base):
     __tablename__ = "recolhimentos_saldo"
+    __por_unidade__ = True
+    __table_args__ = (Index("ix_recolhimentos_saldo_nota_credito_id_data", "nota_credito_id", "data"),)
     id = Column(Integer, primary_key=True, index=True)
     nota_credito_id = Column(Integer, ForeignKey("notas_credito.id", ondelete="CASCADE"))
-    valor = Column(Float, nullable=False)
+    valor = Column(Dinheiro, nullable=False)
     data = Column(Date, nullable=False)
     observacao = Column(String, nullable=True)
 
     nota_credito = relationship("NotaCredito", back_populates="recolhimentos")
 
+# Arquivo de exercícios anteriores.
+# NCs encerradas de exercícios passados são movidas, com todas as suas movimentações,
+# para estas tabelas (ver arquivamento.py). Os IDs originais são preservados.
+
+class NotaCreditoArquivo(Base):
+    __tablename__ = "notas_credito_arquivo"
+    __por_unidade__ = True
+    id = Column(Integer, primary_key=True)
+    numero_nc = Column(String, nullable=False, index=True)
+    valor = Column(Dinheiro, nullable=False)
+    esfera = Column(String)
+    fonte = Column(String(10))
+    ptres = Column(String(6))
+    plano_interno = Column(String, index=True)
+    nd = Column(String(8), index=True)
+    data_chegada = Column(Date)
+    prazo_empenho = Column(Date)
+    descricao = Column(String, nullable=True)
+    secao_responsavel_id = Column(Integer, ForeignKey("secoes.id", ondelete="RESTRICT"), index=True)
+    saldo_disponivel = Column(Dinheiro, nullable=False)
+    status = Column(String)
+    unidade_id = Column(Integer, nullable=True, index=True)
+    arquivado_em = Column(DateTime, nullable=False)
+
+    secao_responsavel = relationship("Seção")
+    empenhos = relationship("EmpenhoArquivo", back_populates="nota_credito")
+    recolhimentos = relationship("RecolhimentoSaldoArquivo", back_populates="nota_credito")
+
+class EmpenhoArquivo(Base):
+    __tablename__ = "empenhos_arquivo"
+    __por_unidade__ = True
+    id = Column(Integer, primary_key=True)
+    numero_ne = Column(String, nullable=False, index=True)
+    valor = Column(Dinheiro, nullable=False)
+    data_empenho = Column(Date)
+    observacao = Column(String, nullable=True)
+    nota_credito_id = Column(Integer, ForeignKey("notas_credito_arquivo.id", ondelete="CASCADE"), index=True)
+    secao_requisitante_id = Column(Integer, ForeignKey("secoes.id", ondelete="RESTRICT"))
+    unidade_id = Column(Integer, nullable=True, index=True)
+
+    nota_credito = relationship("NotaCreditoArquivo", back_populates="empenhos")
+    secao_requisitante = relationship("Seção")
+    anulacoes = relationship("AnulacaoEmpenhoArquivo", back_populates="empenho")
+
+class AnulacaoEmpenhoArquivo(Base):
+    __tablename__ = "anulacoes_empenho_arquivo"
+    __por_unidade__ = True
+    id = Column(Integer, primary_key=True)
+    empenho_id = Column(Integer, ForeignKey("empenhos_arquivo.id", ondelete="CASCADE"), index=True)
+    valor = Column(Dinheiro, nullable=False)
+    data = Column(Date, nullable=False)
+    observacao = Column(String, nullable=True)
+
+    empenho = relationship("EmpenhoArquivo", back_populates="anulacoes")
+
+class RecolhimentoSaldoArquivo(Base):
+    __tablename__ = "recolhimentos_saldo_arquivo"
+    __por_unidade__ = True
+    id = Column(Integer, primary_key=True)
+    nota_credito_id = Column(Integer, ForeignKey("notas_credito_arquivo.id", ondelete="CASCADE"), index=True)
+    valor = Column(Dinheiro, nullable=False)
+    data = Column(Date, nullable=False)
+    observacao = Column(String, nullable=True)
+
+    nota_credito = relationship("NotaCreditoArquivo", back_populates="recolhimentos")
+
 class AuditLog(Base):
+    # No PostgreSQL, a tabela é convertida em particionada por mês (ver particoes_auditoria.py).
     __tablename__ = "audit_logs"
+    __table_args__ = (Index("ix_audit_logs_unidade_timestamp", "unidade_id", "timestamp"),)
     id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    username = Column(String, nullable=False)
+    action = Column(String, nullable=False)
+    details = Column(String, nullable=True)
+    unidade_id = Column(Integer, nullable=True)
+
+class AuditLogArquivo(Base):
+    # Registos antigos de auditoria em bancos sem particionamento nativo.
+    __tablename__ = "audit_logs_arquivo"
+    id = Column(Integer, primary_key=True)
+    timestamp = Column(DateTime, nullable=False, index=True)
     username = Column(String, nullable=False)
     action = Column(String, nullable=False)
-    details = Column(String, nullable=True)
\ No newline at end of file
+    details = Column(String, nullable=True)
+    unidade_id = Column(Integer, nullable=True, index=True)
+
+class VersaoDados(Base):
+    # Contador global incrementado após cada commit que altera dados financeiros (ver versao_dados.py).
+    __tablename__ = "versao_dados"
+    id = Column(Integer, primary_key=True)
+    versao = Column(Integer, nullable=False, default=0)
+
+class ExecucaoDiaria(Base):
+    # Movimentações agregadas por dia, seção, PI e ND (ver serie_temporal.py).
+    __tablename__ = "execucao_diaria"
+    __por_unidade__ = True
+    __table_args__ = (Index("ix_execucao_diaria_unidade_data", "unidade_id", "data"),)
+    id = Column(Integer, primary_key=True)
+    data = Column(Date, nullable=False, index=True)
+    unidade_id = Column(Integer, nullable=True)
+    secao_id = Column(Integer)
+    plano_interno = Column(String)
+    nd = Column(String(8))
+    recebido = Column(Dinheiro, nullable=False, default=0)
+    empenhado = Column(Dinheiro, nullable=False, default=0)
+    anulado = Column(Dinheiro, nullable=False, default=0)
+    recolhido = Column(Dinheiro, nullable=False, default=0)
+
+class ExecucaoDiariaControle(Base):
+    # Último dia consolidado em execucao_diaria, a versão dos dados nesse momento e a data
+    # mais antiga alterada desde então (ver serie_temporal.py).
+    __tablename__ = "execucao_diaria_controle"
+    __por_unidade__ = True
+    id = Column(Integer, primary_key=True)
+    ultimo_dia = Column(Date, nullable=True)
+    versao = Column(Integer, nullable=False, default=0)
+    pendente_desde = Column(Date, nullable=True)
\ No newline at end of file
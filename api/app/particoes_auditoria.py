@@ -0,0 +1,203 @@
+import csv
+import gzip
+import os
+import re
+import tempfile
+from datetime import date, datetime
+
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from app import models
+from app.migracoes import is_postgres, migracao
+
+# Particionamento mensal do log de auditoria.
+# No PostgreSQL, audit_logs é uma tabela particionada por RANGE (timestamp), com uma
+# partição por mês (audit_logs_pAAAAMM). Nos restantes bancos, os registos antigos são
+# movidos para a tabela audit_logs_arquivo. Em ambos os casos, os registos arquivados
+# podem ser exportados para ficheiros .csv.gz em disco local (AUDIT_ARCHIVE_DIR; por
+# omissão no diretório temporário, o único gravável em alguns ambientes de publicação).
+
+AUDIT_ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", os.path.join(tempfile.gettempdir(), "arquivo_auditoria"))
+MESES_A_FRENTE = 12
+
+# Chave do advisory lock da criação de partições (PostgreSQL).
+_LOCK_PARTICOES = 4_002_004
+
+_PADRAO_PARTICAO = re.compile(r"^audit_logs_p(\d{4})(\d{2})$")
+_COLUNAS = ["id", "timestamp", "username", "action", "details", "unidade_id"]
+_COLUNAS_SQL = 'id, "timestamp", username, action, details, unidade_id'
+
+
+def _proximo_mes(ano: int, mes: int):
+    return (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+
+
+def _nome_particao(ano: int, mes: int) -> str:
+    return f"audit_logs_p{ano}{mes:02d}"
+
+
+def _esta_particionada(conn: Connection) -> bool:
+    return is_postgres(conn) and conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'audit_logs'::regclass"
+    )).first() is not None
+
+
+def _particoes_existentes(conn: Connection) -> dict:
+    nomes = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'audit_logs'::regclass"
+    )).scalars()
+    particoes = {}
+    for nome in nomes:
+        m = _PADRAO_PARTICAO.match(nome)
+        if m:
+            particoes[(int(m.group(1)), int(m.group(2)))] = nome
+    return particoes
+
+
+def _particoes_desanexadas(conn: Connection) -> list:
+    # Partições já desanexadas cuja exportação não chegou a terminar.
+    nomes = conn.execute(text(
+        "SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relkind = 'r' AND NOT c.relispartition "
+        "AND c.relname LIKE 'audit_logs_p%'"
+    )).scalars()
+    return sorted(nome for nome in nomes if _PADRAO_PARTICAO.match(nome))
+
+
+def _criar_particao(conn: Connection, ano: int, mes: int):
+    inicio = date(ano, mes, 1)
+    fim = date(*_proximo_mes(ano, mes), 1)
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {_nome_particao(ano, mes)} PARTITION OF audit_logs "
+        f"FOR VALUES FROM ('{inicio.isoformat()}') TO ('{fim.isoformat()}')"
+    ))
+
+
+def _criar_particoes_ate(conn: Connection, ano: int, mes: int, ano_fim: int, mes_fim: int):
+    while (ano, mes) <= (ano_fim, mes_fim):
+        _criar_particao(conn, ano, mes)
+        ano, mes = _proximo_mes(ano, mes)
+
+
+@migracao(1, "audit_logs particionada por mês (PostgreSQL)")
+def particionar_audit_logs(conn: Connection):
+    if not is_postgres(conn) or _esta_particionada(conn):
+        return
+    # A chave primária de uma tabela particionada tem de incluir a chave de partição.
+    conn.execute(text("ALTER TABLE audit_logs RENAME TO audit_logs_legado"))
+    conn.execute(text("ALTER TABLE audit_logs_legado RENAME CONSTRAINT audit_logs_pkey TO audit_logs_legado_pkey"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_audit_logs_id"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_audit_logs_timestamp"))
+    conn.execute(text(
+        "CREATE TABLE audit_logs ("
+        " id INTEGER NOT NULL DEFAULT nextval('audit_logs_id_seq'),"
+        " \"timestamp\" TIMESTAMP WITHOUT TIME ZONE NOT NULL,"
+        " username VARCHAR NOT NULL,"
+        " action VARCHAR NOT NULL,"
+        " details VARCHAR,"
+        " PRIMARY KEY (id, \"timestamp\")"
+        ") PARTITION BY RANGE (\"timestamp\")"
+    ))
+
+    hoje = date.today()
+    mais_antigo = conn.execute(text('SELECT MIN("timestamp") FROM audit_logs_legado')).scalar() or hoje
+    ultimo = conn.execute(text('SELECT MAX("timestamp") FROM audit_logs_legado')).scalar() or hoje
+    ano_fim, mes_fim = max((ultimo.year, ultimo.month), (hoje.year, hoje.month))
+    for _ in range(MESES_A_FRENTE):
+        ano_fim, mes_fim = _proximo_mes(ano_fim, mes_fim)
+    _criar_particoes_ate(conn, mais_antigo.year, mais_antigo.month, ano_fim, mes_fim)
+
+    conn.execute(text(
+        "INSERT INTO audit_logs (id, \"timestamp\", username, action, details) "
+        "SELECT id, COALESCE(\"timestamp\", now() AT TIME ZONE 'utc'), username, action, details FROM audit_logs_legado"
+    ))
+    conn.execute(text("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id"))
+    conn.execute(text("DROP TABLE audit_logs_legado"))
+    conn.execute(text("CREATE INDEX ix_audit_logs_id ON audit_logs (id)"))
+    conn.execute(text("CREATE INDEX ix_audit_logs_timestamp ON audit_logs (\"timestamp\")"))
+
+
+def garantir_particoes(engine: Engine, meses_a_frente: int = MESES_A_FRENTE):
+    # Cria as partições do mês corrente e dos próximos meses que ainda não existam.
+    with engine.begin() as conn:
+        if not _esta_particionada(conn):
+            return
+        # Chamada no arranque e pelo agendador de todos os workers: um de cada vez.
+        conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {"chave": _LOCK_PARTICOES})
+        hoje = date.today()
+        ano_fim, mes_fim = hoje.year, hoje.month
+        for _ in range(meses_a_frente):
+            ano_fim, mes_fim = _proximo_mes(ano_fim, mes_fim)
+        _criar_particoes_ate(conn, hoje.year, hoje.month, ano_fim, mes_fim)
+
+
+def _exportar(conn: Connection, consulta, nome_ficheiro: str) -> str:
+    os.makedirs(AUDIT_ARCHIVE_DIR, exist_ok=True)
+    caminho = os.path.join(AUDIT_ARCHIVE_DIR, nome_ficheiro)
+    resultado = conn.execute(consulta, execution_options={"stream_results": True, "yield_per": 1000})
+    with gzip.open(caminho, "wt", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(_COLUNAS)
+        for row in resultado:
+            writer.writerow(row)
+    return caminho
+
+
+def arquivar_auditoria(engine: Engine, antes_de: date, exportar: bool = True) -> list:
+    """
+    Arquiva os registos de auditoria anteriores a `antes_de`.
+    PostgreSQL: desanexa as partições mensais que terminam até essa data; com `exportar`,
+    grava cada uma em .csv.gz e remove-a. Outros bancos: move os registos para
+    audit_logs_arquivo; com `exportar`, grava-os em .csv.gz e remove-os do arquivo.
+    A desanexação (ou a mudança de tabela) é confirmada antes da exportação, pelo que o
+    bloqueio sobre audit_logs não dura o tempo de escrita dos ficheiros.
+    """
+    with engine.begin() as conn:
+        particionada = _esta_particionada(conn)
+    if particionada:
+        return _arquivar_particoes(engine, antes_de, exportar)
+
+    limite = datetime.combine(antes_de, datetime.min.time())
+    ativos = models.AuditLog.__table__
+    arquivo = models.AuditLogArquivo.__table__
+    colunas = [ativos.c[c] for c in _COLUNAS]
+    with engine.begin() as conn:
+        conn.execute(insert(arquivo).from_select(_COLUNAS, select(*colunas).where(ativos.c.timestamp < limite)))
+        movidos = conn.execute(delete(ativos).where(ativos.c.timestamp < limite)).rowcount
+    item = {"particao": arquivo.name, "registos": movidos, "ficheiro": None}
+    if exportar:
+        with engine.begin() as conn:
+            consulta = select(*[arquivo.c[c] for c in _COLUNAS]).where(arquivo.c.timestamp < limite).order_by(arquivo.c.timestamp)
+            item["ficheiro"] = _exportar(conn, consulta, f"audit_logs_ate_{antes_de.strftime('%Y%m%d')}.csv.gz")
+            conn.execute(delete(arquivo).where(arquivo.c.timestamp < limite))
+    return [item]
+
+
+def _arquivar_particoes(engine: Engine, antes_de: date, exportar: bool) -> list:
+    # Cada DETACH numa transação curta: o ACCESS EXCLUSIVE sobre audit_logs só dura a desanexação.
+    with engine.begin() as conn:
+        particoes = _particoes_existentes(conn)
+        # Inclui as desanexadas em chamadas anteriores cuja exportação falhou.
+        pendentes = _particoes_desanexadas(conn) if exportar else []
+    desanexadas = []
+    for (ano, mes), nome in sorted(particoes.items()):
+        if date(*_proximo_mes(ano, mes), 1) > antes_de:
+            continue
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE audit_logs DETACH PARTITION {nome}"))
+        desanexadas.append(nome)
+    desanexadas = sorted(set(desanexadas) | set(pendentes))
+
+    arquivados = []
+    for nome in desanexadas:
+        item = {"particao": nome, "ficheiro": None}
+        if exportar:
+            # A tabela desanexada já não é lida nem escrita pela aplicação.
+            with engine.begin() as conn:
+                consulta = text(f'SELECT {_COLUNAS_SQL} FROM {nome} ORDER BY "timestamp"')
+                item["ficheiro"] = _exportar(conn, consulta, f"{nome}.csv.gz")
+                conn.execute(text(f"DROP TABLE {nome}"))
+        arquivados.append(item)
+    return arquivados
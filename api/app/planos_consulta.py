@@ -0,0 +1,233 @@
+import json
+import os
+import random
+from datetime import date, datetime, timedelta
+from typing import List
+
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Query, Session
+
+from app import models
+from app.consolidado import DIMENSOES, consulta_consolidado
+from app.consultas import (anulacoes_do_empenho, consultas_kpis, empenhos_da_nota_credito, impressao_digital_relatorio,
+                           listar_anulacoes, listar_auditoria, listar_empenhos, listar_notas_credito, listar_recolhimentos,
+                           ncs_do_relatorio, vinculos_da_secao)
+from app.dinheiro import Centavos
+from app.migracoes import is_postgres, migracao
+from app.prazos import consulta_avisos
+from app.serie_temporal import atualizar_execucao_diaria, consulta_serie
+from app.unidades import restringir_a_unidade
+
+# Índices das consultas mais frequentes e verificação dos seus planos de execução.
+# A migração 5 cria os índices das chaves estrangeiras usadas nas listagens e exclusões,
+# do painel de avisos (status, prazo_empenho) e das colunas de ordenação das listagens.
+# O verificador corre EXPLAIN sobre as mesmas consultas que os endpoints executam (ver
+# consultas.py), sem filtro e com o filtro de unidade, e acusa regressões: leitura sequencial
+# de uma tabela grande ou custo acima do orçamento. As agregações do painel e dos relatórios
+# leem as tabelas inteiras; nelas só o custo é verificado.
+#
+# A verificação corre pela linha de comando (ver verificar_planos.py).
+
+# Orçamentos de custo (unidades do planeador do PostgreSQL) calibrados para 50 000 NCs sintéticas:
+# consultas paginadas e pontuais, e agregações que leem as tabelas inteiras.
+CUSTO_MAXIMO = float(os.getenv("PLANO_CUSTO_MAXIMO", "2000"))
+CUSTO_MAXIMO_AGREGACOES = float(os.getenv("PLANO_CUSTO_MAXIMO_AGREGACOES", "50000"))
+
+# Tabelas em que uma leitura sequencial é sempre uma regressão.
+TABELAS_GRANDES = ("notas_credito", "empenhos", "anulacoes_empenho", "recolhimentos_saldo", "audit_logs")
+
+
+@migracao(5, "índices das chaves estrangeiras, do painel de avisos e das ordenações")
+def indexar_consultas(conn: Connection):
+    for indice in (
+        "ix_empenhos_nota_credito_id ON empenhos (nota_credito_id)",
+        "ix_empenhos_secao_requisitante_id ON empenhos (secao_requisitante_id)",
+        "ix_anulacoes_empenho_empenho_id_data ON anulacoes_empenho (empenho_id, data)",
+        "ix_recolhimentos_saldo_nota_credito_id_data ON recolhimentos_saldo (nota_credito_id, data)",
+        "ix_notas_credito_status_prazo_empenho ON notas_credito (status, prazo_empenho)",
+        "ix_notas_credito_unidade_status_prazo ON notas_credito (unidade_id, status, prazo_empenho)",
+    ):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {indice}"))
+    # Prefixos dos novos índices compostos.
+    conn.execute(text("DROP INDEX IF EXISTS ix_notas_credito_status"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_notas_credito_unidade_status"))
+
+
+def consultas_principais(db: Session, ids: dict) -> dict:
+    """As consultas das listagens, exclusões e avisos (ver consultas.py), com parâmetros de exemplo."""
+    return {
+        "notas_credito.listar": listar_notas_credito(db).limit(10),
+        "notas_credito.excluir": empenhos_da_nota_credito(db, ids["nc_id"]).limit(1),
+        "empenhos.listar": listar_empenhos(db).limit(10),
+        "empenhos.listar_por_nc": listar_empenhos(db, ids["nc_id"]).limit(10),
+        "empenhos.excluir": anulacoes_do_empenho(db, ids["empenho_id"]).limit(1),
+        "anulacoes.listar": listar_anulacoes(db, ids["empenho_id"]),
+        "recolhimentos.listar": listar_recolhimentos(db, ids["nc_id"]),
+        "dashboard.avisos": consulta_avisos(db),
+        **{
+            f"secoes.excluir.{query.column_descriptions[0]['entity'].__tablename__}": query.limit(1)
+            for _, query in vinculos_da_secao(db, ids["secao_sem_vinculos"])
+        },
+        "auditoria.listar": listar_auditoria(db).limit(100),
+    }
+
+
+def consultas_agregadas(db: Session) -> dict:
+    """As agregações do painel e dos relatórios, que leem as tabelas inteiras."""
+    hoje = date.today()
+    return {
+        **{f"dashboard.kpis.{nome}": query for nome, query in consultas_kpis(db).items()},
+        "relatorios.consolidado": consulta_consolidado(db, list(DIMENSOES)),
+        "relatorios.serie_temporal": consulta_serie(db, "secao", date(hoje.year, 1, 1), hoje),
+        "relatorios.pdf": impressao_digital_relatorio(db, models.NotaCredito, True),
+        "relatorios.pdf_ncs": ncs_do_relatorio(db, models.NotaCredito),
+    }
+
+
+def _e_tabela_grande(relacao: str) -> bool:
+    # As partições da auditoria (audit_logs_pAAAAMM) contam como a própria tabela.
+    return any(relacao == t or relacao.startswith(f"{t}_p") for t in TABELAS_GRANDES)
+
+
+def _explicar(conn: Connection, stmt):
+    compilado = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    if compilado.positional:
+        parametros = tuple(compilado.params[nome] for nome in compilado.positiontup)
+    else:
+        parametros = compilado.params
+    if is_postgres(conn):
+        plano = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compilado}", parametros).scalar()
+        return plano[0]["Plan"] if isinstance(plano, list) else json.loads(plano)[0]["Plan"]
+    return conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compilado}", parametros).all()
+
+
+def _leituras_sequenciais_pg(no: dict) -> List[str]:
+    encontradas = []
+    if no.get("Node Type") == "Seq Scan" and _e_tabela_grande(no.get("Relation Name", "")):
+        encontradas.append(no["Relation Name"])
+    for filho in no.get("Plans", []):
+        encontradas.extend(_leituras_sequenciais_pg(filho))
+    return encontradas
+
+
+def _leituras_sequenciais_sqlite(linhas) -> List[str]:
+    # "SCAN tabela" sem "USING ... INDEX" é uma leitura completa da tabela.
+    encontradas = []
+    for linha in linhas:
+        detalhe = linha[-1]
+        if detalhe.startswith("SCAN ") and "USING" not in detalhe:
+            tabela = detalhe.split()[1]
+            if _e_tabela_grande(tabela):
+                encontradas.append(tabela)
+    return encontradas
+
+
+def _verificar(conn: Connection, stmt, custo_maximo: float, permitir_sequenciais: bool) -> dict:
+    plano = _explicar(conn, stmt)
+    if is_postgres(conn):
+        custo = plano["Total Cost"]
+        sequenciais = _leituras_sequenciais_pg(plano)
+    else:
+        custo = None
+        sequenciais = _leituras_sequenciais_sqlite(plano)
+    problemas = [] if permitir_sequenciais else [f"leitura sequencial de {t}" for t in sequenciais]
+    if custo is not None and custo > custo_maximo:
+        problemas.append(f"custo {custo:.1f} acima do orçamento de {custo_maximo:.1f}")
+    return {"custo": custo, "sequenciais": sequenciais, "problemas": problemas}
+
+
+def verificar_planos(conn: Connection, custo_maximo: float = CUSTO_MAXIMO, custo_maximo_agregacoes: float = CUSTO_MAXIMO_AGREGACOES) -> List[dict]:
+    """
+    Corre EXPLAIN sobre as consultas dos endpoints, sem filtro e restritas a uma unidade, e
+    devolve um resultado por consulta: nome, custo estimado (apenas PostgreSQL), leituras
+    sequenciais e problemas encontrados. Nas agregações só o custo é verificado.
+    """
+    ids = {
+        "unidade_id": conn.execute(select(func.min(models.Unidade.id))).scalar(),
+        "nc_id": conn.execute(select(func.max(models.NotaCredito.id))).scalar() or 0,
+        "empenho_id": conn.execute(select(func.max(models.Empenho.id))).scalar() or 0,
+        # As exclusões só passam sem dependentes: é o caso em que a verificação lê mais.
+        "secao_sem_vinculos": (conn.execute(select(func.max(models.Seção.id))).scalar() or 0) + 1,
+    }
+    db = Session(bind=conn)
+    grupos = [(consultas_principais(db, ids), custo_maximo, False), (consultas_agregadas(db), custo_maximo_agregacoes, True)]
+    resultados = []
+    for consultas, custo_grupo, permitir_sequenciais in grupos:
+        for nome, consulta in consultas.items():
+            stmt = consulta.statement if isinstance(consulta, Query) else consulta
+            variantes = [(nome, stmt)]
+            if ids["unidade_id"] is not None:
+                variantes.append((f"{nome} [unidade]", restringir_a_unidade(stmt, ids["unidade_id"])))
+            for nome_variante, variante in variantes:
+                resultados.append({"consulta": nome_variante, **_verificar(conn, variante, custo_grupo, permitir_sequenciais)})
+    return resultados
+
+
+def popular_dados_sinteticos(engine: Engine, quantidade_ncs: int, lote: int = 5000, semente: int = 42):
+    """Preenche um banco vazio com NCs, empenhos, anulações, recolhimentos e auditoria sintéticos."""
+    aleatorio = random.Random(semente)
+    hoje = date.today()
+    with engine.begin() as conn:
+        if conn.execute(select(func.count()).select_from(models.NotaCredito)).scalar():
+            raise RuntimeError("O banco já tem Notas de Crédito; os dados sintéticos só podem ser gerados num banco vazio.")
+        unidade_id = conn.execute(select(func.min(models.Unidade.id))).scalar()
+        secoes = [
+            conn.execute(insert(models.Seção).values(nome=f"SEÇÃO SINTÉTICA {i}", unidade_id=unidade_id).returning(models.Seção.id)).scalar()
+            for i in range(20)
+        ]
+
+        def inserir(modelo, linhas):
+            for i in range(0, len(linhas), lote):
+                conn.execute(insert(modelo), linhas[i:i + lote])
+
+        ncs = []
+        for i in range(1, quantidade_ncs + 1):
+            chegada = hoje - timedelta(days=aleatorio.randint(0, 5 * 365))
+            prazo = chegada + timedelta(days=aleatorio.randint(10, 120))
+            ativa = prazo >= hoje
+            ncs.append({
+                "id": i, "numero_nc": f"2099NC{i:07d}", "valor": Centavos(100_000), "esfera": "FEDERAL", "fonte": "1000",
+                "ptres": "123456", "plano_interno": f"PI{i % 300:04d}", "nd": f"3390{i % 50:02d}",
+                "data_chegada": chegada, "prazo_empenho": prazo,
+                "secao_responsavel_id": aleatorio.choice(secoes), "saldo_disponivel": Centavos(40_000 if ativa else 0),
+                "status": "Ativa" if ativa else "Totalmente Empenhada", "unidade_id": unidade_id,
+            })
+        inserir(models.NotaCredito, ncs)
+
+        empenhos, anulacoes, recolhimentos = [], [], []
+        for nc in ncs:
+            for _ in range(3):
+                empenho_id = len(empenhos) + 1
+                empenhos.append({
+                    "id": empenho_id, "numero_ne": f"2099NE{empenho_id:08d}", "valor": Centavos(20_000),
+                    "data_empenho": nc["data_chegada"] + timedelta(days=aleatorio.randint(0, 30)),
+                    "nota_credito_id": nc["id"], "secao_requisitante_id": aleatorio.choice(secoes), "unidade_id": unidade_id,
+                })
+                if aleatorio.random() < 0.15:
+                    anulacoes.append({"empenho_id": empenho_id, "valor": Centavos(5_000), "data": empenhos[-1]["data_empenho"] + timedelta(days=5)})
+            if aleatorio.random() < 0.25:
+                recolhimentos.append({"nota_credito_id": nc["id"], "valor": Centavos(10_000), "data": nc["prazo_empenho"]})
+        inserir(models.Empenho, empenhos)
+        inserir(models.AnulacaoEmpenho, anulacoes)
+        inserir(models.RecolhimentoSaldo, recolhimentos)
+
+        # A auditoria fica no mês corrente, cuja partição existe sempre.
+        inicio_mes = datetime.combine(hoje.replace(day=1), datetime.min.time())
+        segundos_no_mes = max(int((datetime.now() - inicio_mes).total_seconds()), 1)
+        inserir(models.AuditLog, [
+            {"timestamp": inicio_mes + timedelta(seconds=aleatorio.randrange(segundos_no_mes)), "username": "sintetico",
+             "action": "NC_CREATED", "details": None, "unidade_id": unidade_id}
+            for _ in range(quantidade_ncs)
+        ])
+
+        if is_postgres(conn):
+            for tabela in ("notas_credito", "empenhos", "recolhimentos_saldo"):
+                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{tabela}', 'id'), (SELECT MAX(id) FROM {tabela}))"))
+    # A série temporal lê execucao_diaria, consolidada normalmente pelo agendador.
+    with Session(bind=engine) as db:
+        atualizar_execucao_diaria(db)
+        db.commit()
+    # Estatísticas atualizadas para o planeador (fora da transação: VACUUM não corre dentro de uma).
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE" if is_postgres(conn) else "ANALYZE"))
@@ -0,0 +1,101 @@
+import os
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import case, insert, text, update
+from sqlalchemy.orm import Query, Session, joinedload
+
+from app import models, schemas
+from app.cache import CacheMemoria
+from app.database import unidade_atual
+from app.unidades import executar_em_cada_armazenamento
+from app.versao_dados import obter_versao
+
+# Prazos de empenho das NCs.
+# O agendador (ver agendador.py) marca como "Vencida", num único UPDATE, as NCs ativas
+# cujo prazo já passou, e regista uma entrada de auditoria por unidade. Com vários workers,
+# só um processa em cada ciclo (advisory lock no PostgreSQL). A lista de avisos do painel
+# (prazo nos próximos dias) fica pré-calculada em memória e é refeita quando a versão dos
+# dados muda, pelo que o painel e as consultas de NCs ativas só leem NCs ainda em prazo.
+
+STATUS_ATIVA = "Ativa"
+STATUS_VENCIDA = "Vencida"
+STATUS_TOTALMENTE_EMPENHADA = "Totalmente Empenhada"
+STATUS_RECOLHIDA = "Recolhida"
+
+DIAS_AVISO = int(os.getenv("PRAZOS_DIAS_AVISO", "7"))
+
+# Chave do advisory lock do processamento de prazos (PostgreSQL).
+_LOCK_PRAZOS = 4_002_003
+
+_cache_avisos = CacheMemoria()
+
+
+def status_com_saldo(nc: models.NotaCredito, hoje: Optional[date] = None) -> str:
+    """Status de uma NC que volta a ter saldo: ativa se ainda estiver no prazo, vencida caso contrário."""
+    hoje = hoje or date.today()
+    return STATUS_VENCIDA if nc.prazo_empenho and nc.prazo_empenho < hoje else STATUS_ATIVA
+
+
+def status_com_saldo_sql(hoje: Optional[date] = None):
+    """O mesmo que status_com_saldo, como expressão SQL (para UPDATEs em massa)."""
+    hoje = hoje or date.today()
+    return case((models.NotaCredito.prazo_empenho < hoje, STATUS_VENCIDA), else_=STATUS_ATIVA)
+
+
+def vencer_notas_credito(db: Session, hoje: Optional[date] = None) -> int:
+    """
+    Marca como vencidas as NCs ativas com prazo anterior a hoje e regista a auditoria.
+    Executa na transação da sessão recebida; o commit fica a cargo de quem chama.
+    Devolve o número de NCs vencidas (0 se outro worker já estiver a processar).
+    """
+    hoje = hoje or date.today()
+    if db.get_bind(models.NotaCredito).dialect.name == "postgresql":
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(:chave)"), {"chave": _LOCK_PRAZOS}).scalar():
+            return 0
+
+    NC = models.NotaCredito
+    vencidas = db.execute(
+        update(NC).where(NC.status == STATUS_ATIVA, NC.prazo_empenho < hoje).values(status=STATUS_VENCIDA)
+        .returning(NC.numero_nc, NC.unidade_id),
+        execution_options={"synchronize_session": False},
+    ).all()
+    if not vencidas:
+        return 0
+
+    por_unidade = {}
+    for numero_nc, unidade_id in vencidas:
+        por_unidade.setdefault(unidade_id, []).append(numero_nc)
+    agora = datetime.utcnow()
+    db.execute(insert(models.AuditLog).values([
+        {"timestamp": agora, "username": "sistema", "action": "NC_EXPIRED", "unidade_id": unidade_id,
+         "details": f"{len(numeros)} NC(s) com prazo de empenho vencido: {', '.join(sorted(numeros))}."}
+        for unidade_id, numeros in por_unidade.items()
+    ]))
+    return len(vencidas)
+
+
+def processar_prazos(hoje: Optional[date] = None) -> int:
+    """Um ciclo do agendador: o banco principal e, depois, cada unidade com armazenamento próprio."""
+    return executar_em_cada_armazenamento(lambda db: vencer_notas_credito(db, hoje), "os prazos das NCs")
+
+
+def consulta_avisos(db: Session, hoje: Optional[date] = None) -> Query:
+    hoje = hoje or date.today()
+    NC = models.NotaCredito
+    return db.query(NC).options(joinedload(NC.secao_responsavel)).filter(
+        NC.status == STATUS_ATIVA,
+        NC.prazo_empenho <= hoje + timedelta(days=DIAS_AVISO),
+    ).order_by(NC.prazo_empenho)
+
+
+def avisos_de_prazo(db: Session) -> List[schemas.NotaCreditoInDB]:
+    """NCs ativas com prazo de empenho até DIAS_AVISO dias, pré-calculadas por versão dos dados."""
+    hoje = date.today()
+    chave = (unidade_atual.get(), hoje, obter_versao(db))
+    avisos = _cache_avisos.get(chave)
+    if avisos is None:
+        ncs = consulta_avisos(db, hoje).all()
+        avisos = [schemas.NotaCreditoInDB.model_validate(nc) for nc in ncs]
+        _cache_avisos.set(chave, avisos)
+    return avisos
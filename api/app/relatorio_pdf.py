@@ -0,0 +1,255 @@
+import glob
+import hashlib
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import List, Optional, Tuple
+
+from pypdf import PdfReader, PdfWriter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Flowable, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+# Relatório geral de NCs em PDF, com cache em disco.
+# O PDF é guardado sob o hash do seu conteúdo (linhas das NCs, cabeçalho e opções), por
+# isso filtros diferentes que resultem nas mesmas NCs partilham a entrada e qualquer
+# alteração nas NCs envolvidas gera uma entrada nova. O cache é limitado pelo tamanho total
+# (remove as entradas usadas há mais tempo). A linha "Gerado por", a única que varia por
+# utilizador, é carimbada na primeira página no momento do envio.
+# Relatórios grandes são divididos em blocos de NCs, desenhados em paralelo em processos
+# separados e juntos num único documento. Este módulo só depende do reportlab e do pypdf,
+# para que os processos de desenho não carreguem a aplicação.
+
+# Por omissão no diretório temporário: na Vercel só /tmp aceita escrita.
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cache_pdf"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_MB", "500")) * 1024 * 1024
+PDF_NCS_POR_BLOCO = int(os.getenv("PDF_NCS_POR_BLOCO", "200"))
+PDF_PROCESSOS = int(os.getenv("PDF_PROCESSOS", str(os.cpu_count() or 1)))
+
+_METADADO_POSICAO = "/SalcPosicaoGeradoPor"
+
+_pool = None
+
+
+def estilos():
+    styles = getSampleStyleSheet()
+    styles['h1'].alignment = 1 # Center alignment
+    styles['h2'].alignment = 1
+    return styles
+
+
+class _LinhaGeradoPor(Flowable):
+    # Reserva a linha do "Gerado por" e regista onde ficou na página.
+    def __init__(self, altura: float):
+        super().__init__()
+        self.altura = altura
+        self.posicao = None
+
+    def wrap(self, largura, altura):
+        return largura, self.altura
+
+    def draw(self):
+        self.posicao = self.canv.absolutePosition(0, 0)
+
+
+def chave_relatorio(cabecalho: str, titulo: str, incluir_detalhes: bool, linhas: list) -> str:
+    """Endereço do PDF: hash das opções e das linhas (com os totais dos detalhes) das NCs envolvidas."""
+    conteudo = json.dumps([cabecalho, titulo, incluir_detalhes, linhas], default=str, separators=(",", ":"))
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+def _desenhar_bloco(ncs: List[dict], incluir_detalhes: bool, cabecalho: Optional[Tuple[str, str]]) -> Tuple[bytes, Optional[tuple]]:
+    """Desenha um bloco de NCs; o primeiro bloco leva o cabeçalho e devolve a posição do "Gerado por"."""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4), topMargin=0.5*inch, bottomMargin=0.5*inch)
+    styles = estilos()
+    elements = []
+    linha_gerado_por = None
+
+    if cabecalho:
+        header_text, titulo = cabecalho
+        elements.append(Paragraph(header_text, styles['h2']))
+        elements.append(Spacer(1, 0.2*inch))
+        elements.append(Paragraph(titulo, styles['h1']))
+        linha_gerado_por = _LinhaGeradoPor(styles['Normal'].leading)
+        elements.append(linha_gerado_por)
+        elements.append(Spacer(1, 0.25*inch))
+        if not ncs:
+            elements.append(Paragraph("Nenhuma Nota de Crédito encontrada para os filtros selecionados.", styles['Normal']))
+
+    for nc in ncs:
+        nc_data = [[
+            Paragraph(f"<b>NC:</b> {nc['numero_nc']}", styles['Normal']),
+            Paragraph(f"<b>PI:</b> {nc['plano_interno']}", styles['Normal']),
+            Paragraph(f"<b>ND:</b> {nc['nd']}", styles['Normal']),
+            Paragraph(f"<b>Seção:</b> {nc['secao']}", styles['Normal']),
+        ], [
+            Paragraph(f"<b>Valor:</b> R$ {nc['valor']:,.2f}", styles['Normal']),
+            Paragraph(f"<b>Saldo:</b> R$ {nc['saldo_disponivel']:,.2f}", styles['Normal']),
+            Paragraph(f"<b>Status:</b> {nc['status']}", styles['Normal']),
+            Paragraph(f"<b>Prazo:</b> {nc['prazo_empenho'].strftime('%d/%m/%Y')}", styles['Normal']),
+        ]]
+
+        tbl = Table(nc_data, colWidths=[2.7*inch, 2.7*inch, 2.7*inch, 2.7*inch])
+        tbl.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor("#E6E6E6")),
+            ('GRID', (0,0), (-1,-1), 1, colors.black),
+            ('BOX', (0,0), (-1,-1), 2, colors.black),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ]))
+        elements.append(tbl)
+
+        if incluir_detalhes:
+            if nc['empenhos']:
+                elements.append(Spacer(1, 0.1*inch))
+                empenhos_data = [["<b>Empenhos da NC</b>", "", "", ""], ["Nº da NE", "Valor", "Data", "Observação"]]
+                for e in nc['empenhos']:
+                    empenhos_data.append([e['numero_ne'], f"R$ {e['valor']:,.2f}", e['data_empenho'].strftime('%d/%m/%Y'), e['observacao'] or ''])
+
+                empenhos_tbl = Table(empenhos_data, colWidths=[2.7*inch, 2.7*inch, 2.7*inch, 2.7*inch])
+                empenhos_tbl.setStyle(TableStyle([
+                    ('SPAN', (0,0), (-1,0)), ('ALIGN', (0,0), (-1,0), 'CENTER'),
+                    ('BACKGROUND', (0, 1), (-1, 1), colors.lightgrey),
+                    ('GRID', (0,1), (-1,-1), 1, colors.grey),
+                ]))
+                elements.append(empenhos_tbl)
+
+            if nc['recolhimentos']:
+                elements.append(Spacer(1, 0.1*inch))
+                recolhimentos_data = [["<b>Recolhimentos da NC</b>", "", ""], ["Valor", "Data", "Observação"]]
+                for r in nc['recolhimentos']:
+                    recolhimentos_data.append([f"R$ {r['valor']:,.2f}", r['data'].strftime('%d/%m/%Y'), r['observacao'] or ''])
+
+                recolhimentos_tbl = Table(recolhimentos_data, colWidths=[3.6*inch, 3.6*inch, 3.6*inch])
+                recolhimentos_tbl.setStyle(TableStyle([
+                    ('SPAN', (0,0), (-1,0)), ('ALIGN', (0,0), (-1,0), 'CENTER'),
+                    ('BACKGROUND', (0, 1), (-1, 1), colors.lightgrey),
+                    ('GRID', (0,1), (-1,-1), 1, colors.grey),
+                ]))
+                elements.append(recolhimentos_tbl)
+
+        elements.append(Spacer(1, 0.2*inch))
+
+    doc.build(elements)
+    return buffer.getvalue(), linha_gerado_por.posicao if linha_gerado_por else None
+
+
+def _desenhar_em_paralelo(blocos: list, incluir_detalhes: bool, cabecalho: Tuple[str, str]) -> list:
+    global _pool
+    cabecalhos = [cabecalho] + [None] * (len(blocos) - 1)
+    if PDF_PROCESSOS > 1 and len(blocos) > 1:
+        try:
+            if _pool is None:
+                # "spawn": os processos filhos não herdam as threads e ligações do servidor.
+                _pool = ProcessPoolExecutor(max_workers=PDF_PROCESSOS, mp_context=get_context("spawn"))
+            return list(_pool.map(_desenhar_bloco, blocos, [incluir_detalhes] * len(blocos), cabecalhos))
+        except Exception as e:
+            print(f"Desenho paralelo do relatório indisponível, a desenhar sequencialmente: {e}")
+            _pool = None
+    return [_desenhar_bloco(bloco, incluir_detalhes, cab) for bloco, cab in zip(blocos, cabecalhos)]
+
+
+def encerrar():
+    # Termina os processos de desenho (desligar da aplicação).
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def _desenhar(ncs: List[dict], incluir_detalhes: bool, cabecalho: Tuple[str, str]) -> bytes:
+    blocos = [ncs[i:i + PDF_NCS_POR_BLOCO] for i in range(0, len(ncs), PDF_NCS_POR_BLOCO)] or [[]]
+    partes = _desenhar_em_paralelo(blocos, incluir_detalhes, cabecalho)
+
+    writer = PdfWriter()
+    for conteudo, _ in partes:
+        writer.append(PdfReader(io.BytesIO(conteudo)))
+    x, y = partes[0][1]
+    writer.add_metadata({_METADADO_POSICAO: f"{x:.2f},{y:.2f}"})
+    saida = io.BytesIO()
+    writer.write(saida)
+    return saida.getvalue()
+
+
+def _gravar_no_cache(chave: str, conteudo: bytes):
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    caminho = os.path.join(PDF_CACHE_DIR, f"{chave}.pdf")
+    descritor, temporario = tempfile.mkstemp(dir=PDF_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(descritor, "wb") as f:
+            f.write(conteudo)
+        os.replace(temporario, caminho)
+    except Exception:
+        os.remove(temporario)
+        raise
+    _limitar_cache(manter=caminho)
+
+
+def _limitar_cache(manter: str):
+    # LRU por tamanho: a data de modificação é atualizada a cada uso da entrada.
+    entradas = []
+    for caminho in glob.glob(os.path.join(PDF_CACHE_DIR, "*.pdf")):
+        try:
+            info = os.stat(caminho)
+        except OSError:
+            continue
+        entradas.append((info.st_mtime, info.st_size, caminho))
+    total = sum(tamanho for _, tamanho, _ in entradas)
+    for _, tamanho, caminho in sorted(entradas):
+        if total <= PDF_CACHE_MAX_BYTES:
+            break
+        if caminho == manter:
+            continue
+        try:
+            os.remove(caminho)
+            total -= tamanho
+        except OSError:
+            pass
+
+
+def _carimbar(origem, username: str) -> bytes:
+    # origem: caminho do PDF em cache ou o próprio conteúdo (bytes).
+    reader = PdfReader(io.BytesIO(origem) if isinstance(origem, bytes) else origem)
+    x, y = (float(v) for v in reader.metadata[_METADADO_POSICAO].split(","))
+    primeira = reader.pages[0]
+
+    sobreposicao = io.BytesIO()
+    c = canvas.Canvas(sobreposicao, pagesize=(float(primeira.mediabox.width), float(primeira.mediabox.height)))
+    estilo = estilos()['Normal']
+    c.setFont(estilo.fontName, estilo.fontSize)
+    c.drawString(x, y + estilo.leading - estilo.fontSize, f"Gerado por: {username} em {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
+    c.save()
+
+    writer = PdfWriter(clone_from=reader)
+    writer.pages[0].merge_page(PdfReader(sobreposicao).pages[0])
+    saida = io.BytesIO()
+    writer.write(saida)
+    return saida.getvalue()
+
+
+def relatorio_notas_credito(chave: str, carregar_ncs, incluir_detalhes: bool, cabecalho: Tuple[str, str], username: str) -> bytes:
+    """
+    PDF do relatório geral para a chave dada, desenhado apenas se não estiver em cache.
+    `carregar_ncs` devolve as NCs (dicionários) e só é chamado em caso de falha do cache.
+    """
+    caminho = os.path.join(PDF_CACHE_DIR, f"{chave}.pdf")
+    if os.path.exists(caminho):
+        try:
+            os.utime(caminho)
+            return _carimbar(caminho, username)
+        except FileNotFoundError:
+            pass  # Removido pelo LRU de outro worker entretanto.
+    conteudo = _desenhar(carregar_ncs(), incluir_detalhes, cabecalho)
+    try:
+        _gravar_no_cache(chave, conteudo)
+    except OSError as e:
+        # Sem cache (disco cheio, sistema de ficheiros só de leitura): envia o PDF desenhado.
+        print(f"Não foi possível gravar o relatório no cache de PDF: {e}")
+    return _carimbar(conteudo, username)
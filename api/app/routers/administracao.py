@@ -1,12 +1,17 @@
+from datetime import date
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Response
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 
 # CORREÇÃO: Importações absolutas
 from app import models, schemas
-from app.database import get_db
-from app.routers.autenticacao import get_current_admin_user, get_current_user, get_password_hash, log_audit_action
+from app.arquivamento import arquivar_exercicio
+from app.consultas import vinculos_da_secao
+from app.prazos import processar_prazos
+from app.unidades import esquecer_unidade, preparar_armazenamento, carregar_unidade
+from app.database import get_db, get_read_db
+from app.routers.autenticacao import get_current_admin_user, get_current_user, get_current_user_com_unidade, get_password_hash, log_audit_action
 
 router = APIRouter(
     prefix="/admin",
@@ -16,13 +21,18 @@ router = APIRouter(
 
 @router.post("/users", response_model=schemas.UserInDB, status_code=status.HTTP_201_CREATED, summary="Cria um novo utilizador")
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), admin_user: models.User = Depends(get_current_admin_user)):
-    if db.query(models.User).filter(models.User.username == user.username).first():
+    # Nomes de utilizador e e-mails são únicos em todas as unidades.
+    if db.query(models.User).filter(models.User.username == user.username).execution_options(todas_unidades=True).first():
         raise HTTPException(status_code=400, detail="Nome de utilizador já existe")
-    if db.query(models.User).filter(models.User.email == user.email).first():
+    if db.query(models.User).filter(models.User.email == user.email).execution_options(todas_unidades=True).first():
         raise HTTPException(status_code=400, detail="E-mail já registado")
+    # Administradores de uma unidade só criam utilizadores na própria unidade.
+    unidade_id = admin_user.unidade_id if admin_user.unidade_id is not None else user.unidade_id
+    if unidade_id is not None and db.get(models.Unidade, unidade_id) is None:
+        raise HTTPException(status_code=404, detail="Unidade não encontrada.")
     try:
         hashed_password = get_password_hash(user.password)
-        new_user = models.User(username=user.username, email=user.email, hashed_password=hashed_password, role=user.role)
+        new_user = models.User(username=user.username, email=user.email, hashed_password=hashed_password, role=user.role, unidade_id=unidade_id)
         db.add(new_user)
         log_audit_action(db, admin_user.username, "USER_CREATED", f"Utilizador '{user.username}' criado com perfil '{user.role.value}'.")
         db.commit()
@@ -35,7 +45,7 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), admin_u
         raise HTTPException(status_code=500, detail="Ocorreu um erro ao criar o utilizador.")
 
 @router.get("/users", response_model=List[schemas.UserInDB], summary="Lista todos os utilizadores")
-def read_users(db: Session = Depends(get_db)):
+def read_users(db: Session = Depends(get_read_db)):
     return db.query(models.User).order_by(models.User.username).all()
 
 @router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT, summary="Exclui um utilizador")
@@ -52,7 +62,7 @@ def delete_user(user_id: int, db: Session = Depends(get_db), admin_user: models.
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @router.post("/secoes", response_model=schemas.SeçãoInDB, status_code=status.HTTP_201_CREATED, summary="Adiciona uma nova seção")
-def create_secao(secao: schemas.SeçãoCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_secao(secao: schemas.SeçãoCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user_com_unidade)):
     try:
         db_secao = models.Seção(nome=secao.nome)
         db.add(db_secao)
@@ -65,7 +75,7 @@ def create_secao(secao: schemas.SeçãoCreate, db: Session = Depends(get_db), cu
         raise HTTPException(status_code=400, detail="Uma seção com este nome já existe.")
 
 @router.get("/secoes", response_model=List[schemas.SeçãoInDB], summary="Lista todas as seções", dependencies=[Depends(get_current_user)])
-def read_secoes(db: Session = Depends(get_db)):
+def read_secoes(db: Session = Depends(get_read_db)):
     return db.query(models.Seção).order_by(models.Seção.nome).all()
 
 @router.put("/secoes/{secao_id}", response_model=schemas.SeçãoInDB, summary="Atualiza o nome de uma seção")
@@ -89,12 +99,85 @@ def delete_secao(secao_id: int, db: Session = Depends(get_db), admin_user: model
     db_secao = db.query(models.Seção).filter(models.Seção.id == secao_id).first()
     if not db_secao:
         raise HTTPException(status_code=404, detail="Seção não encontrada.")
-    if db.query(models.NotaCredito).filter(models.NotaCredito.secao_responsavel_id == secao_id).first():
-        raise HTTPException(status_code=400, detail=f"Não é possível excluir '{db_secao.nome}', pois está vinculada a Notas de Crédito.")
-    if db.query(models.Empenho).filter(models.Empenho.secao_requisitante_id == secao_id).first():
-        raise HTTPException(status_code=400, detail=f"Não é possível excluir '{db_secao.nome}', pois está vinculada a Empenhos.")
+    for vinculo, query in vinculos_da_secao(db, secao_id):
+        if query.first():
+            raise HTTPException(status_code=400, detail=f"Não é possível excluir '{db_secao.nome}', pois está vinculada a {vinculo}.")
     secao_nome = db_secao.nome
     db.delete(db_secao)
     log_audit_action(db, admin_user.username, "SECTION_DELETED", f"Seção '{secao_nome}' (ID: {secao_id}) foi excluída.")
     db.commit()
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@router.post("/arquivamento", response_model=schemas.ResultadoArquivamento, summary="Arquiva as NCs encerradas de um exercício anterior")
+def arquivar_exercicio_anterior(
+    ano: int = Query(..., description="Exercício (ano) a arquivar; inclui os exercícios anteriores"),
+    db: Session = Depends(get_db),
+    admin_user: models.User = Depends(get_current_admin_user)
+):
+    if ano >= date.today().year:
+        raise HTTPException(status_code=400, detail="Só é possível arquivar exercícios anteriores ao corrente.")
+    try:
+        contagem = arquivar_exercicio(db, ano)
+        log_audit_action(db, admin_user.username, "EXERCICIO_ARQUIVADO", f"Exercício {ano}: {contagem['notas_credito']} NC(s), {contagem['empenhos']} empenho(s), {contagem['anulacoes']} anulação(ões) e {contagem['recolhimentos']} recolhimento(s) arquivados.")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Ocorreu um erro ao arquivar o exercício.")
+    return {"ano": ano, **contagem}
+
+@router.post("/prazos/processar", summary="Marca como vencidas as NCs com prazo de empenho expirado")
+def processar_prazos_agora(admin_user: models.User = Depends(get_current_admin_user)):
+    # O agendador faz o mesmo periodicamente; este endpoint serve para execuções pontuais
+    # ou para ambientes sem processos de longa duração (cron externo).
+    _exigir_administrador_global(admin_user)
+    return {"vencidas": processar_prazos()}
+
+# --- Unidades (apenas administradores sem unidade) ---
+
+def _exigir_administrador_global(admin_user: models.User):
+    if admin_user.unidade_id is not None:
+        raise HTTPException(status_code=403, detail="Acesso restrito a administradores de todas as unidades.")
+
+@router.post("/unidades", response_model=schemas.UnidadeInDB, status_code=status.HTTP_201_CREATED, summary="Cria uma nova unidade")
+def create_unidade(unidade: schemas.UnidadeCreate, db: Session = Depends(get_db), admin_user: models.User = Depends(get_current_admin_user)):
+    _exigir_administrador_global(admin_user)
+    try:
+        db_unidade = models.Unidade(**unidade.dict())
+        db.add(db_unidade)
+        db.flush()
+        # Schema ou banco próprio: cria as tabelas da unidade antes de confirmar.
+        preparar_armazenamento(carregar_unidade(db, db_unidade.id))
+        log_audit_action(db, admin_user.username, "UNIT_CREATED", f"Unidade '{unidade.sigla}' criada.")
+        db.commit()
+        db.refresh(db_unidade)
+        return db_unidade
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Uma unidade com esta sigla já existe.")
+    except Exception as e:
+        db.rollback()
+        esquecer_unidade(db_unidade.id)
+        raise HTTPException(status_code=500, detail=f"Não foi possível preparar o armazenamento da unidade: {str(e)}")
+
+@router.get("/unidades", response_model=List[schemas.UnidadeInDB], summary="Lista as unidades")
+def read_unidades(db: Session = Depends(get_read_db), admin_user: models.User = Depends(get_current_admin_user)):
+    _exigir_administrador_global(admin_user)
+    return db.query(models.Unidade).order_by(models.Unidade.sigla).all()
+
+@router.put("/unidades/{unidade_id}", response_model=schemas.UnidadeInDB, summary="Atualiza uma unidade")
+def update_unidade(unidade_id: int, unidade_update: schemas.UnidadeCreate, db: Session = Depends(get_db), admin_user: models.User = Depends(get_current_admin_user)):
+    _exigir_administrador_global(admin_user)
+    db_unidade = db.query(models.Unidade).filter(models.Unidade.id == unidade_id).first()
+    if not db_unidade:
+        raise HTTPException(status_code=404, detail="Unidade não encontrada.")
+    for key, value in unidade_update.dict().items():
+        setattr(db_unidade, key, value)
+    try:
+        log_audit_action(db, admin_user.username, "UNIT_UPDATED", f"Unidade '{db_unidade.sigla}' (ID: {unidade_id}) atualizada.")
+        db.commit()
+        db.refresh(db_unidade)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Uma unidade com esta sigla já existe.")
+    esquecer_unidade(unidade_id)
+    return db_unidade
\ No newline at end of file
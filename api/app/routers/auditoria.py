@@ -1,12 +1,14 @@
-from typing import List
-from fastapi import APIRouter, Depends
+from datetime import date
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
 
 # CORREÇÃO: Importações absolutas
 from app import models, schemas
-from app.database import get_db
-from app.routers.autenticacao import get_current_admin_user
+from app.consultas import listar_auditoria
+from app.database import engine, get_db, get_read_db
+from app.particoes_auditoria import arquivar_auditoria
+from app.routers.autenticacao import get_current_admin_user, get_current_global_admin_user, log_audit_action
 
 router = APIRouter(
     prefix="/audit-logs",
@@ -16,9 +18,24 @@ router = APIRouter(
 
 @router.get("", response_model=List[schemas.AuditLogInDB], summary="Retorna o log de auditoria do sistema")
 def read_audit_logs(
-    skip: int = 0, 
-    limit: int = 100, 
-    db: Session = Depends(get_db)
+    skip: int = 0,
+    limit: int = 100,
+    data_inicio: Optional[date] = Query(None, description="Data inicial (inclusiva); limita a consulta às partições do período"),
+    data_fim: Optional[date] = Query(None, description="Data final (inclusiva)"),
+    db: Session = Depends(get_read_db)
 ):
-    logs = db.query(models.AuditLog).order_by(desc(models.AuditLog.timestamp)).offset(skip).limit(limit).all()
-    return logs
\ No newline at end of file
+    logs = listar_auditoria(db, data_inicio, data_fim).offset(skip).limit(limit).all()
+    return logs
+
+@router.post("/arquivar", response_model=List[schemas.ArquivoAuditoria], summary="Arquiva (e opcionalmente exporta) os registos de auditoria antigos")
+def arquivar_audit_logs(
+    antes_de: date = Query(..., description="Arquiva os registos anteriores a esta data"),
+    exportar: bool = Query(True, description="Exporta os registos arquivados para .csv.gz e remove-os do banco"),
+    db: Session = Depends(get_db),
+    admin_user: models.User = Depends(get_current_global_admin_user)
+):
+    # Abrange as partições de todas as unidades: reservado a administradores sem unidade.
+    arquivados = arquivar_auditoria(engine, antes_de, exportar)
+    log_audit_action(db, admin_user.username, "AUDIT_ARCHIVED", f"Registos anteriores a {antes_de.strftime('%d/%m/%Y')} arquivados: {', '.join(a['particao'] for a in arquivados) or 'nenhum'}.")
+    db.commit()
+    return arquivados
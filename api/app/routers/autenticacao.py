@@ -1,7 +1,9 @@
 import os
 from datetime import datetime, timedelta
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -9,7 +11,9 @@ from sqlalchemy.orm import Session
 
 # CORREÇÃO: Importações absolutas
 from app import models, schemas
-from app.database import get_db
+from app.database import get_db, unidade_atual
+from app.fila_auditoria import AUDIT_WRITE_BEHIND, fila_auditoria
+from app.unidades import carregar_unidade, definir_unidade
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
@@ -37,11 +41,20 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def log_audit_action(db: Session, username: str, action: str, details: str = None):
+def log_audit_action(db: Session, username: str, action: str, details: str = None, strict: bool = True):
+    # Eventos estritos (padrão) entram na transação de quem chama e só persistem com o seu commit.
+    # Eventos não-estritos vão para a fila write-behind, quando esta está ativa.
+    if not strict and AUDIT_WRITE_BEHIND and fila_auditoria.ativa:
+        fila_auditoria.put(username, action, details)
+        return
     log = models.AuditLog(username=username, action=action, details=details)
     db.add(log)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db),
+    x_unidade: Optional[int] = Header(None, description="Unidade de trabalho (apenas para utilizadores sem unidade)")
+):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Credenciais inválidas. Por favor, faça login novamente.",
@@ -58,23 +71,47 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     user = db.query(models.User).filter(models.User.username == username).first()
     if user is None:
         raise credentials_exception
+
+    # A partir daqui, as consultas do pedido ficam restritas à unidade do utilizador.
+    unidade_id = user.unidade_id if user.unidade_id is not None else x_unidade
+    if unidade_id is not None:
+        unidade = carregar_unidade(db, unidade_id)
+        if unidade is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unidade não encontrada.")
+        definir_unidade(unidade)
     return user
 
+async def get_current_user_com_unidade(current_user: models.User = Depends(get_current_user)):
+    # Registos de uma unidade (seções, NCs, empenhos) só são criados com uma unidade de trabalho.
+    if unidade_atual.get() is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Indique a unidade de trabalho no cabeçalho X-Unidade.")
+    return current_user
+
 async def get_current_admin_user(current_user: models.User = Depends(get_current_user)):
     if current_user.role != models.UserRole.ADMINISTRADOR:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Acesso restrito a administradores")
     return current_user
 
+async def get_current_global_admin_user(admin_user: models.User = Depends(get_current_admin_user)):
+    # Administradores sem unidade: operações que abrangem todas as unidades.
+    if admin_user.unidade_id is not None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Acesso restrito a administradores de todas as unidades.")
+    return admin_user
+
 @router.post("/token", response_model=schemas.Token, summary="Autentica o utilizador e retorna um token JWT")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = db.query(models.User).filter(models.User.username == form_data.username).first()
     if not user or not verify_password(form_data.password, user.hashed_password):
-        log_audit_action(db, form_data.username, "LOGIN_FAILED", "Tentativa de login com credenciais incorretas")
-        db.commit()
+        log_audit_action(db, form_data.username, "LOGIN_FAILED", "Tentativa de login com credenciais incorretas", strict=False)
+        if db.new:
+            # Sem a fila write-behind, o evento ficou na sessão.
+            db.commit()
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Utilizador ou senha incorretos")
 
     access_token = create_access_token(data={"sub": user.username, "role": user.role.value})
-    log_audit_action(db, user.username, "LOGIN_SUCCESS")
+    if user.unidade_id is not None:
+        definir_unidade(carregar_unidade(db, user.unidade_id))
+    log_audit_action(db, user.username, "LOGIN_SUCCESS", strict=False)
     db.commit()
     
     return {"access_token": access_token, "token_type": "bearer"}
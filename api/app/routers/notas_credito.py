@@ -1,13 +1,15 @@
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import desc
 
 from app import models, schemas
-from app.database import get_db
-from app.autenticacao import get_current_user, get_current_admin_user, log_audit_action
+from app.consultas import empenhos_da_nota_credito, listar_notas_credito
+from app.database import get_db, get_read_db
+from app.prazos import STATUS_ATIVA, STATUS_VENCIDA, status_com_saldo
+from app.transmissao import RESPOSTA_NDJSON, aceita_ndjson, resposta_ndjson, tamanho_da_pagina
+from app.autenticacao import get_current_user, get_current_user_com_unidade, get_current_admin_user, log_audit_action
 
 router = APIRouter(
     prefix="/notas-credito",
@@ -16,12 +18,13 @@ router = APIRouter(
 )
 
 @router.post("", response_model=schemas.NotaCreditoInDB, status_code=status.HTTP_201_CREATED, summary="Cria uma nova Nota de Crédito")
-def create_nota_credito(nc_in: schemas.NotaCreditoCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_nota_credito(nc_in: schemas.NotaCreditoCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user_com_unidade)):
     if not db.query(models.Seção).filter(models.Seção.id == nc_in.secao_responsavel_id).first():
         raise HTTPException(status_code=404, detail="Seção responsável não encontrada.")
     try:
         # PGD/PGA-SIGA 2024.01.29 - Ajuste ND (Natureza de Despesa) para aceitar 8 dígitos, conforme Manual SIAFI 2024.
-        db_nc = models.NotaCredito(**nc_in.dict(), saldo_disponivel=nc_in.valor, status="Ativa")
+        db_nc = models.NotaCredito(**nc_in.dict(), saldo_disponivel=nc_in.valor)
+        db_nc.status = status_com_saldo(db_nc)
         db.add(db_nc)
         log_audit_action(db, current_user.username, "NC_CREATED", f"NC '{nc_in.numero_nc}' criada com valor R$ {nc_in.valor:,.2f}.")
         db.commit()
@@ -31,32 +34,34 @@ def create_nota_credito(nc_in: schemas.NotaCreditoCreate, db: Session = Depends(
         db.rollback()
         raise HTTPException(status_code=400, detail="Uma Nota de Crédito com este número já existe.")
 
-@router.get("", response_model=schemas.PaginatedNCS, summary="Lista e filtra as Notas de Crédito")
+@router.get("", response_model=schemas.PaginatedNCS, responses=RESPOSTA_NDJSON, summary="Lista e filtra as Notas de Crédito")
 def read_notas_credito(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: Session = Depends(get_read_db),
     page: int = Query(1, ge=1),
-    size: int = Query(10, ge=1, le=1000),
+    size: Optional[int] = Query(None, ge=1, description="Padrão: 10 (1000 em NDJSON); máximo 1000. Em NDJSON, administradores e utilizadores de todas as unidades podem omiti-lo para receber todas as NCs"),
     numero_nc: Optional[str] = Query(None, description="Busca parcial pelo número da NC"),
     plano_interno: Optional[str] = Query(None),
     nd: Optional[str] = Query(None),
     secao_responsavel_id: Optional[int] = Query(None),
-    status: Optional[str] = Query(None)
+    status: Optional[str] = Query(None),
+    incluir_arquivo: bool = Query(False, description="Inclui as NCs arquivadas de exercícios anteriores"),
+    current_user: models.User = Depends(get_current_user)
 ):
-    query = db.query(models.NotaCredito).options(joinedload(models.NotaCredito.secao_responsavel))
-    
-    if numero_nc: query = query.filter(models.NotaCredito.numero_nc.ilike(f"%{numero_nc}%"))
-    if plano_interno: query = query.filter(models.NotaCredito.plano_interno.ilike(f"%{plano_interno}%"))
-    if nd: query = query.filter(models.NotaCredito.nd.ilike(f"%{nd}%"))
-    if secao_responsavel_id: query = query.filter(models.NotaCredito.secao_responsavel_id == secao_responsavel_id)
-    if status: query = query.filter(models.NotaCredito.status == status)
-    
+    size = tamanho_da_pagina(request, current_user, size)
+    query = listar_notas_credito(db, numero_nc, plano_interno, nd, secao_responsavel_id, status, incluir_arquivo)
+    if aceita_ndjson(request):
+        if size:
+            query = query.offset((page - 1) * size).limit(size)
+        return resposta_ndjson(db, query, schemas.NotaCreditoInDB, {"page": page if size else None, "size": size})
+
     total = query.count()
-    results = query.order_by(desc(models.NotaCredito.data_chegada)).offset((page - 1) * size).limit(size).all()
+    results = query.offset((page - 1) * size).limit(size).all()
     
     return {"total": total, "page": page, "size": size, "results": results}
 
 @router.get("/{nc_id}", response_model=schemas.NotaCreditoInDB, summary="Obtém detalhes de uma Nota de Crédito")
-def read_nota_credito(nc_id: int, db: Session = Depends(get_db)):
+def read_nota_credito(nc_id: int, db: Session = Depends(get_read_db)):
     db_nc = db.query(models.NotaCredito).options(joinedload(models.NotaCredito.secao_responsavel)).filter(models.NotaCredito.id == nc_id).first()
     if not db_nc:
         raise HTTPException(status_code=404, detail="Nota de Crédito não encontrada.")
@@ -64,14 +69,16 @@ def read_nota_credito(nc_id: int, db: Session = Depends(get_db)):
 
 @router.put("/{nc_id}", response_model=schemas.NotaCreditoInDB, summary="Atualiza uma Nota de Crédito")
 def update_nota_credito(nc_id: int, nc_update: schemas.NotaCreditoUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    db_nc = db.query(models.NotaCredito).filter(models.NotaCredito.id == nc_id).first()
+    db_nc = db.query(models.NotaCredito).filter(models.NotaCredito.id == nc_id).with_for_update().first()
     if not db_nc:
         raise HTTPException(status_code=404, detail="Nota de Crédito não encontrada.")
+    if not db.query(models.Seção).filter(models.Seção.id == nc_update.secao_responsavel_id).first():
+        raise HTTPException(status_code=404, detail="Seção responsável não encontrada.")
     
     valor_ja_empenhado = db_nc.valor - db_nc.saldo_disponivel
     novo_saldo = nc_update.valor - valor_ja_empenhado
     
-    if novo_saldo < -0.01: # Usar uma pequena tolerância para erros de ponto flutuante
+    if novo_saldo < 0:
         raise HTTPException(status_code=400, detail=f"O novo valor total (R$ {nc_update.valor:,.2f}) é menor que o valor já comprometido (R$ {valor_ja_empenhado:,.2f}) nesta NC.")
 
     update_data = nc_update.dict(exclude_unset=True)
@@ -79,6 +86,9 @@ def update_nota_credito(nc_id: int, nc_update: schemas.NotaCreditoUpdate, db: Se
         setattr(db_nc, key, value)
     
     db_nc.saldo_disponivel = novo_saldo
+    # Um novo prazo de empenho pode reativar uma NC vencida (ou vencer uma ativa).
+    if db_nc.status in (STATUS_ATIVA, STATUS_VENCIDA):
+        db_nc.status = status_com_saldo(db_nc)
     
     try:
         log_audit_action(db, current_user.username, "NC_UPDATED", f"NC '{db_nc.numero_nc}' (ID: {nc_id}) atualizada.")
@@ -95,7 +105,7 @@ def delete_nota_credito(nc_id: int, db: Session = Depends(get_db), admin_user: m
     if not db_nc:
         raise HTTPException(status_code=404, detail="Nota de Crédito não encontrada.")
     
-    if db.query(models.Empenho).filter(models.Empenho.nota_credito_id == nc_id).first():
+    if empenhos_da_nota_credito(db, nc_id).first():
         raise HTTPException(status_code=400, detail=f"Não é possível excluir a NC '{db_nc.numero_nc}', pois ela possui empenho(s) vinculado(s). Exclua os empenhos primeiro.")
     
     nc_numero = db_nc.numero_nc
@@ -1,19 +1,29 @@
 import io
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, Query, Response
-from sqlalchemy.orm import Session, joinedload
+import pandas as pd
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Response
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
 
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import inch
 
 from app import models
-from app.database import get_db
-from app.autenticacao import get_current_user, log_audit_action
+from app.cache import CacheMemoria
+from app.consolidado import DIMENSOES, METRICAS, consultar_consolidado
+from app.consultas import impressao_digital_relatorio, ncs_do_relatorio
+from app.database import get_db, get_read_db, unidade_atual
+from app.relatorio_pdf import chave_relatorio, estilos, relatorio_notas_credito
+from app.serie_temporal import atualizar_execucao_diaria, consultar_serie
+from app.snapshot import FORMATOS, TABELAS, obter_snapshot
+from app.transmissao import pode_transmitir_tudo
+from app.unidades import CABECALHO_PADRAO
+from app.versao_dados import obter_versao
+from app.autenticacao import get_current_user, get_current_global_admin_user, log_audit_action
 
 router = APIRouter(
     prefix="/relatorios",
@@ -21,111 +31,192 @@ router = APIRouter(
     dependencies=[Depends(get_current_user)]
 )
 
+# Impressões digitais do relatório PDF por unidade, filtros e versão dos dados.
+_cache_impressoes = CacheMemoria()
+
+def _texto_cabecalho(db: Session) -> str:
+    # Texto do cabeçalho da unidade do utilizador.
+    unidade = unidade_atual.get()
+    registro = db.get(models.Unidade, unidade.id) if unidade else None
+    return registro.cabecalho if registro and registro.cabecalho else CABECALHO_PADRAO
+
+def _cabecalho(db: Session, styles, titulo: str, username: str) -> list:
+    elements = []
+    
+    # Cabeçalho
+    elements.append(Paragraph(_texto_cabecalho(db), styles['h2']))
+    elements.append(Spacer(1, 0.2*inch))
+    
+    # Título
+    elements.append(Paragraph(titulo, styles['h1']))
+    elements.append(Paragraph(f"Gerado por: {username} em {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}", styles['Normal']))
+    elements.append(Spacer(1, 0.25*inch))
+    return elements
+
+def _ordenar_por_pi(linhas: list, incluir_arquivo: bool, pi) -> list:
+    # Com o arquivo, as duas consultas (já ordenadas) são intercaladas por PI.
+    if incluir_arquivo:
+        linhas.sort(key=lambda linha: pi(linha) or "")
+    return linhas
+
 @router.get("/pdf", summary="Gera um relatório consolidado em PDF")
 def get_relatorio_pdf(
     db: Session = Depends(get_db), 
+    db_leitura: Session = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user),
     plano_interno: Optional[str] = Query(None), 
     nd: Optional[str] = Query(None),
     secao_responsavel_id: Optional[int] = Query(None), 
     status: Optional[str] = Query(None),
-    incluir_detalhes: bool = Query(False, description="Incluir detalhes de empenhos e recolhimentos no relatório")
+    incluir_detalhes: bool = Query(False, description="Incluir detalhes de empenhos e recolhimentos no relatório"),
+    incluir_arquivo: bool = Query(False, description="Incluir NCs arquivadas de exercícios anteriores")
+):
+    modelos = [models.NotaCredito, models.NotaCreditoArquivo] if incluir_arquivo else [models.NotaCredito]
+    cabecalho = (_texto_cabecalho(db_leitura), "RELATÓRIO GERAL DE NOTAS DE CRÉDITO")
+    filtros = {"plano_interno": plano_interno, "nd": nd, "secao_responsavel_id": secao_responsavel_id, "status": status}
+
+    # Impressão digital das NCs envolvidas (ver consultas.py); só é recalculada quando os dados mudam.
+    chave_impressao = (unidade_atual.get(), *filtros.values(), incluir_detalhes, incluir_arquivo, obter_versao(db_leitura))
+    linhas = _cache_impressoes.get(chave_impressao)
+    if linhas is None:
+        linhas = []
+        for modelo in modelos:
+            linhas.extend(tuple(linha) for linha in impressao_digital_relatorio(db_leitura, modelo, incluir_detalhes, **filtros))
+        linhas = _ordenar_por_pi(linhas, incluir_arquivo, lambda linha: linha[2])
+        _cache_impressoes.set(chave_impressao, linhas)
+
+    def carregar_ncs():
+        ncs = []
+        for modelo in modelos:
+            ncs.extend(ncs_do_relatorio(db_leitura, modelo, **filtros).all())
+        return [{
+            "numero_nc": nc.numero_nc, "plano_interno": nc.plano_interno, "nd": nc.nd, "secao": nc.secao_responsavel.nome,
+            "valor": nc.valor.reais, "saldo_disponivel": nc.saldo_disponivel.reais, "status": nc.status, "prazo_empenho": nc.prazo_empenho,
+            "empenhos": [{"numero_ne": e.numero_ne, "valor": e.valor.reais, "data_empenho": e.data_empenho, "observacao": e.observacao} for e in nc.empenhos],
+            "recolhimentos": [{"valor": r.valor.reais, "data": r.data, "observacao": r.observacao} for r in nc.recolhimentos],
+        } for nc in _ordenar_por_pi(ncs, incluir_arquivo, lambda nc: nc.plano_interno)]
+
+    chave = chave_relatorio(*cabecalho, incluir_detalhes, linhas)
+    conteudo = relatorio_notas_credito(chave, carregar_ncs, incluir_detalhes, cabecalho, current_user.username)
+    
+    headers = {'Content-Disposition': 'inline; filename="relatorio_salc.pdf"'}
+    log_audit_action(db, current_user.username, "REPORT_GENERATED", f"Filtros: PI={plano_interno}, ND={nd}, Seção={secao_responsavel_id}, Status={status}", strict=False)
+    db.commit()
+    return Response(content=conteudo, media_type='application/pdf', headers=headers)
+
+_ROTULOS = {
+    "plano_interno": "PI", "nd": "ND", "secao": "Seção",
+    "valor": "Valor", "empenhado": "Empenhado", "anulado": "Anulado",
+    "recolhido": "Recolhido", "saldo": "Saldo", "quantidade": "Qtd. NCs",
+}
+
+def _rotulos_dimensoes(linha: dict, agrupar_por: List[str]) -> dict:
+    # "TOTAL" só nas dimensões totalizadas pelo ROLLUP; um valor nulo real fica em branco.
+    return {d: "TOTAL" if d in linha["totalizadas"] else (linha[d] if linha[d] is not None else "") for d in agrupar_por}
+
+@router.get("/consolidado", summary="Totais de execução agrupados por PI, ND e/ou Seção (JSON, XLSX ou PDF)")
+def get_relatorio_consolidado(
+    db: Session = Depends(get_db),
+    db_leitura: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user),
+    agrupar_por: List[str] = Query(["plano_interno"], description="Dimensões de agrupamento, por ordem: plano_interno, nd, secao"),
+    formato: str = Query("json", pattern="^(json|xlsx|pdf)$"),
+    plano_interno: Optional[str] = Query(None),
+    nd: Optional[str] = Query(None),
+    secao_responsavel_id: Optional[int] = Query(None),
+    status: Optional[str] = Query(None),
+    incluir_arquivo: bool = Query(False, description="Incluir NCs arquivadas de exercícios anteriores")
 ):
+    if not agrupar_por or any(d not in DIMENSOES for d in agrupar_por) or len(set(agrupar_por)) != len(agrupar_por):
+        raise HTTPException(status_code=400, detail=f"Dimensões de agrupamento inválidas. Use uma ou mais de: {', '.join(DIMENSOES)}.")
+
+    linhas = consultar_consolidado(db_leitura, agrupar_por, plano_interno, nd, secao_responsavel_id, status, incluir_arquivo)
+
+    if formato == "json":
+        return {"agrupar_por": agrupar_por, "linhas": linhas}
+
+    log_audit_action(db, current_user.username, "REPORT_GENERATED", f"Consolidado ({formato}) por {', '.join(agrupar_por)}. Filtros: PI={plano_interno}, ND={nd}, Seção={secao_responsavel_id}, Status={status}", strict=False)
+    db.commit()
+
+    colunas = agrupar_por + list(METRICAS)
+    if formato == "xlsx":
+        buffer = io.BytesIO()
+        df = pd.DataFrame([{**linha, **_rotulos_dimensoes(linha, agrupar_por)} for linha in linhas], columns=colunas)
+        df.rename(columns=_ROTULOS).to_excel(buffer, index=False, sheet_name="Consolidado")
+        headers = {'Content-Disposition': 'attachment; filename="consolidado_salc.xlsx"'}
+        return Response(content=buffer.getvalue(), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers=headers)
+
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=landscape(A4), topMargin=0.5*inch, bottomMargin=0.5*inch)
-    styles = getSampleStyleSheet()
-    styles['h1'].alignment = 1 # Center alignment
-    styles['h2'].alignment = 1
-    
-    elements = []
-    
-    # Cabeçalho
-    header_text = "MINISTÉRIO DA DEFESA<br/>EXÉRCITO BRASILEIRO<br/>2º CENTRO DE GEOINFORMAÇÃO"
-    elements.append(Paragraph(header_text, styles['h2']))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    # Título
-    titulo = "RELATÓRIO GERAL DE NOTAS DE CRÉDITO"
-    elements.append(Paragraph(titulo, styles['h1']))
-    elements.append(Paragraph(f"Gerado por: {current_user.username} em {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}", styles['Normal']))
-    elements.append(Spacer(1, 0.25*inch))
-    
-    # Query principal
-    query = db.query(models.NotaCredito).options(
-        joinedload(models.NotaCredito.secao_responsavel),
-        joinedload(models.NotaCredito.empenhos),
-        joinedload(models.NotaCredito.recolhimentos)
-    ).order_by(models.NotaCredito.plano_interno)
-    
-    # Filtros
-    if plano_interno: query = query.filter(models.NotaCredito.plano_interno.ilike(f"%{plano_interno}%"))
-    if nd: query = query.filter(models.NotaCredito.nd.ilike(f"%{nd}%"))
-    if secao_responsavel_id: query = query.filter(models.NotaCredito.secao_responsavel_id == secao_responsavel_id)
-    if status: query = query.filter(models.NotaCredito.status.ilike(f"%{status}%"))
-    
-    ncs = query.all()
-    
-    if not ncs:
-        elements.append(Paragraph("Nenhuma Nota de Crédito encontrada para os filtros selecionados.", styles['Normal']))
-    else:
-        for nc in ncs:
-            nc_data = [[
-                Paragraph(f"<b>NC:</b> {nc.numero_nc}", styles['Normal']),
-                Paragraph(f"<b>PI:</b> {nc.plano_interno}", styles['Normal']),
-                Paragraph(f"<b>ND:</b> {nc.nd}", styles['Normal']),
-                Paragraph(f"<b>Seção:</b> {nc.secao_responsavel.nome}", styles['Normal']),
-            ], [
-                Paragraph(f"<b>Valor:</b> R$ {nc.valor:,.2f}", styles['Normal']),
-                Paragraph(f"<b>Saldo:</b> R$ {nc.saldo_disponivel:,.2f}", styles['Normal']),
-                Paragraph(f"<b>Status:</b> {nc.status}", styles['Normal']),
-                Paragraph(f"<b>Prazo:</b> {nc.prazo_empenho.strftime('%d/%m/%Y')}", styles['Normal']),
-            ]]
-            
-            tbl = Table(nc_data, colWidths=[2.7*inch, 2.7*inch, 2.7*inch, 2.7*inch])
-            tbl.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor("#E6E6E6")),
-                ('GRID', (0,0), (-1,-1), 1, colors.black),
-                ('BOX', (0,0), (-1,-1), 2, colors.black),
-                ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ]))
-            elements.append(tbl)
-            
-            if incluir_detalhes:
-                if nc.empenhos:
-                    elements.append(Spacer(1, 0.1*inch))
-                    empenhos_data = [["<b>Empenhos da NC</b>", "", "", ""], ["Nº da NE", "Valor", "Data", "Observação"]]
-                    for e in nc.empenhos:
-                        empenhos_data.append([e.numero_ne, f"R$ {e.valor:,.2f}", e.data_empenho.strftime('%d/%m/%Y'), e.observacao or ''])
-                    
-                    empenhos_tbl = Table(empenhos_data, colWidths=[2.7*inch, 2.7*inch, 2.7*inch, 2.7*inch])
-                    empenhos_tbl.setStyle(TableStyle([
-                        ('SPAN', (0,0), (-1,0)), ('ALIGN', (0,0), (-1,0), 'CENTER'),
-                        ('BACKGROUND', (0, 1), (-1, 1), colors.lightgrey),
-                        ('GRID', (0,1), (-1,-1), 1, colors.grey),
-                    ]))
-                    elements.append(empenhos_tbl)
-
-                if nc.recolhimentos:
-                    elements.append(Spacer(1, 0.1*inch))
-                    recolhimentos_data = [["<b>Recolhimentos da NC</b>", "", ""], ["Valor", "Data", "Observação"]]
-                    for r in nc.recolhimentos:
-                        recolhimentos_data.append([f"R$ {r.valor:,.2f}", r.data.strftime('%d/%m/%Y'), r.observacao or ''])
-
-                    recolhimentos_tbl = Table(recolhimentos_data, colWidths=[3.6*inch, 3.6*inch, 3.6*inch])
-                    recolhimentos_tbl.setStyle(TableStyle([
-                        ('SPAN', (0,0), (-1,0)), ('ALIGN', (0,0), (-1,0), 'CENTER'),
-                        ('BACKGROUND', (0, 1), (-1, 1), colors.lightgrey),
-                        ('GRID', (0,1), (-1,-1), 1, colors.grey),
-                    ]))
-                    elements.append(recolhimentos_tbl)
-            
-            elements.append(Spacer(1, 0.2*inch))
+    styles = estilos()
+    elements = _cabecalho(db_leitura, styles, "EXECUÇÃO ORÇAMENTÁRIA CONSOLIDADA", current_user.username)
 
+    dados = [[_ROTULOS[c] for c in colunas]]
+    estilo = [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('GRID', (0,0), (-1,-1), 1, colors.grey),
+        ('ALIGN', (len(agrupar_por), 1), (-1, -1), 'RIGHT'),
+    ]
+    for i, linha in enumerate(linhas, start=1):
+        dados.append(
+            list(_rotulos_dimensoes(linha, agrupar_por).values())
+            + [f"R$ {linha[m]:,.2f}" for m in METRICAS if m != "quantidade"]
+            + [linha["quantidade"]]
+        )
+        if linha["subtotal"]:
+            estilo.append(('BACKGROUND', (0, i), (-1, i), colors.HexColor("#E6E6E6")))
+    tbl = Table(dados, repeatRows=1)
+    tbl.setStyle(TableStyle(estilo))
+    elements.append(tbl)
     doc.build(elements)
-    buffer.seek(0)
-    
-    headers = {'Content-Disposition': 'inline; filename="relatorio_salc.pdf"'}
-    log_audit_action(db, current_user.username, "REPORT_GENERATED", f"Filtros: PI={plano_interno}, ND={nd}, Seção={secao_responsavel_id}, Status={status}")
+
+    headers = {'Content-Disposition': 'inline; filename="consolidado_salc.pdf"'}
+    return Response(content=buffer.getvalue(), media_type='application/pdf', headers=headers)
+
+@router.get("/serie-temporal", summary="Séries diárias acumuladas de execução por Seção, PI ou ND")
+def get_serie_temporal(
+    db_leitura: Session = Depends(get_read_db),
+    agrupar_por: str = Query("secao", pattern="^(secao|plano_interno|nd)$"),
+    data_inicio: Optional[date] = Query(None, description="Padrão: 1º de janeiro do ano corrente"),
+    data_fim: Optional[date] = Query(None, description="Padrão: hoje"),
+    secao_responsavel_id: Optional[int] = Query(None),
+    plano_interno: Optional[str] = Query(None),
+    nd: Optional[str] = Query(None)
+):
+    data_fim = data_fim or date.today()
+    data_inicio = data_inicio or date(data_fim.year, 1, 1)
+    if data_inicio > data_fim or (data_fim - data_inicio).days > 3660:
+        raise HTTPException(status_code=400, detail="Período inválido (máximo de 10 anos).")
+
+    # Só lê execucao_diaria: a consolidação é feita pelo agendador (ver serie_temporal.py).
+    series = consultar_serie(db_leitura, agrupar_por, data_inicio, data_fim, secao_responsavel_id, plano_interno, nd)
+    return {"agrupar_por": agrupar_por, "data_inicio": data_inicio, "data_fim": data_fim, "series": series}
+
+@router.post("/serie-temporal/reprocessar", summary="Reprocessa a série temporal a partir de uma data (Apenas Admin de todas as unidades)")
+def reprocessar_serie_temporal(
+    desde: date = Query(..., description="Primeiro dia a reprocessar"),
+    db: Session = Depends(get_db),
+    # Reconstrói execucao_diaria de todas as unidades do armazenamento.
+    admin_user: models.User = Depends(get_current_global_admin_user)
+):
+    atualizar_execucao_diaria(db, desde=desde)
+    log_audit_action(db, admin_user.username, "SERIE_REPROCESSADA", f"Série temporal reprocessada desde {desde.strftime('%d/%m/%Y')}.")
     db.commit()
-    
-    return Response(content=buffer.getvalue(), media_type='application/pdf', headers=headers)
\ No newline at end of file
+    return {"desde": desde}
+
+@router.get("/snapshot.{formato}", summary="Exporta uma tabela completa em formato colunar (Parquet ou Arrow IPC)")
+def get_snapshot(
+    formato: str = Path(..., pattern="^(parquet|arrow)$"),
+    tabela: str = Query("notas_credito", pattern=f"^({'|'.join(TABELAS)})$", description="Tabela a exportar"),
+    incluir_arquivo: bool = Query(False, description="Incluir os registos arquivados de exercícios anteriores"),
+    db: Session = Depends(get_db),
+    db_leitura: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # Tabelas completas, como as listagens NDJSON: apenas administradores e utilizadores sem unidade.
+    if not pode_transmitir_tudo(current_user):
+        raise HTTPException(status_code=403, detail="Exportação de tabelas completas restrita a administradores.")
+    caminho = obter_snapshot(db_leitura, tabela, formato, incluir_arquivo)
+    log_audit_action(db, current_user.username, "SNAPSHOT_EXPORTED", f"Tabela {tabela} exportada em {formato}.", strict=False)
+    db.commit()
+    return FileResponse(caminho, media_type=FORMATOS[formato], filename=f"{tabela}_salc.{formato}")
@@ -0,0 +1,44 @@
+from typing import Optional
+
+from sqlalchemy import case, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.dinheiro import Centavos
+from app.prazos import STATUS_ATIVA, STATUS_RECOLHIDA, STATUS_TOTALMENTE_EMPENHADA, status_com_saldo_sql
+
+# Movimentação do saldo das NCs.
+# Cada débito ou crédito é um único UPDATE com aritmética inteira em centavos. O débito
+# leva a condição saldo_disponivel >= valor no próprio UPDATE: não há leitura prévia nem
+# tolerâncias, e dois débitos concorrentes nunca deixam o saldo negativo. O status passa a
+# "Totalmente Empenhada" ou "Recolhida" quando o saldo chega exatamente a zero.
+
+
+def debitar_saldo(db: Session, nc_id: int, valor: Centavos, status_se_zerar: str, apenas_ativa: bool = False) -> Optional[str]:
+    """
+    Debita o valor do saldo da NC e devolve o seu número, ou None se o débito não foi
+    aplicado (NC inexistente, não ativa com apenas_ativa, ou saldo insuficiente).
+    """
+    NC = models.NotaCredito
+    novo_saldo = NC.saldo_disponivel - valor
+    stmt = update(NC).where(NC.id == nc_id, NC.saldo_disponivel >= valor)
+    if apenas_ativa:
+        stmt = stmt.where(NC.status == STATUS_ATIVA)
+    stmt = stmt.values(
+        saldo_disponivel=novo_saldo,
+        status=case((novo_saldo == 0, status_se_zerar), else_=NC.status),
+    ).returning(NC.numero_nc)
+    return db.execute(stmt, execution_options={"synchronize_session": False}).scalar()
+
+
+def creditar_saldo(db: Session, nc_id: int, valor: Centavos) -> Optional[str]:
+    """Devolve o valor ao saldo da NC, reabrindo-a se estava sem saldo. Devolve o número da NC."""
+    NC = models.NotaCredito
+    stmt = update(NC).where(NC.id == nc_id).values(
+        saldo_disponivel=NC.saldo_disponivel + valor,
+        status=case(
+            (NC.status.in_((STATUS_TOTALMENTE_EMPENHADA, STATUS_RECOLHIDA)), status_com_saldo_sql()),
+            else_=NC.status,
+        ),
+    ).returning(NC.numero_nc)
+    return db.execute(stmt, execution_options={"synchronize_session": False}).scalar()
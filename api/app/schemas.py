@@ -4,6 +4,7 @@ from typing import List, Optional
 
 from pydantic import BaseModel, EmailStr, Field, validator
 
+from .dinheiro import Reais, ReaisPositivo
 from .models import UserRole
 
 # Schemas de Dados (Pydantic)
@@ -20,6 +21,7 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     password: str
     role: UserRole
+    unidade_id: Optional[int] = None
 
     @validator('password')
     def validate_password_strength(cls, v):
@@ -36,6 +38,23 @@ class UserCreate(UserBase):
 class UserInDB(UserBase):
     id: int
     role: UserRole
+    unidade_id: Optional[int] = None
+    class Config:
+        from_attributes = True
+
+# --- Unidades ---
+class UnidadeBase(BaseModel):
+    sigla: str
+    nome: str
+    cabecalho: Optional[str] = None
+    esquema: Optional[str] = Field(None, pattern=r'^[a-z_][a-z0-9_]*$')
+    database_url: Optional[str] = None
+
+class UnidadeCreate(UnidadeBase):
+    pass
+
+class UnidadeInDB(UnidadeBase):
+    id: int
     class Config:
         from_attributes = True
 
@@ -54,7 +73,7 @@ class SeçãoInDB(SeçãoBase):
 # --- Notas de Crédito ---
 class NotaCreditoBase(BaseModel):
     numero_nc: str
-    valor: float = Field(..., gt=0)
+    valor: ReaisPositivo
     esfera: str
     fonte: str = Field(..., max_length=10)
     ptres: str = Field(..., max_length=6)
@@ -73,7 +92,7 @@ class NotaCreditoUpdate(NotaCreditoBase):
 
 class NotaCreditoInDB(NotaCreditoBase):
     id: int
-    saldo_disponivel: float
+    saldo_disponivel: Reais
     status: str
     secao_responsavel: SeçãoInDB
     class Config:
@@ -82,7 +101,7 @@ class NotaCreditoInDB(NotaCreditoBase):
 # --- Empenhos ---
 class EmpenhoBase(BaseModel):
     numero_ne: str
-    valor: float = Field(..., gt=0)
+    valor: ReaisPositivo
     data_empenho: date
     observacao: Optional[str] = None
     nota_credito_id: int
@@ -101,7 +120,7 @@ class EmpenhoInDB(EmpenhoBase):
 # --- Anulações e Recolhimentos ---
 class AnulacaoEmpenhoBase(BaseModel):
     empenho_id: int
-    valor: float = Field(..., gt=0)
+    valor: ReaisPositivo
     data: date
     observacao: Optional[str] = None
 
@@ -112,7 +131,7 @@ class AnulacaoEmpenhoInDB(AnulacaoEmpenhoBase):
 
 class RecolhimentoSaldoBase(BaseModel):
     nota_credito_id: int
-    valor: float = Field(..., gt=0)
+    valor: ReaisPositivo
     data: date
     observacao: Optional[str] = None
 
@@ -121,6 +140,14 @@ class RecolhimentoSaldoInDB(RecolhimentoSaldoBase):
     class Config:
         from_attributes = True
 
+# --- Arquivamento de exercícios ---
+class ResultadoArquivamento(BaseModel):
+    ano: int
+    notas_credito: int
+    empenhos: int
+    anulacoes: int
+    recolhimentos: int
+
 # --- Auditoria ---
 class AuditLogInDB(BaseModel):
     id: int
@@ -131,6 +158,11 @@ class AuditLogInDB(BaseModel):
     class Config:
         from_attributes = True
 
+class ArquivoAuditoria(BaseModel):
+    particao: str
+    registos: Optional[int] = None
+    ficheiro: Optional[str] = None
+
 # --- Paginação ---
 class PaginatedNCS(BaseModel):
     total: int
@@ -0,0 +1,218 @@
+from datetime import date, timedelta
+from typing import Optional
+
+from sqlalchemy import Date, case, delete, event, func, insert, inspect, literal, or_, select, text, true, union_all, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app import models
+from app.arquivamento import (anulacoes_com_arquivo, empenhos_com_arquivo,
+                              notas_credito_com_arquivo, recolhimentos_com_arquivo)
+from app.database import SessionLocal
+from app.dinheiro import Centavos
+from app.migracoes import em_cada_armazenamento, migracao
+from app.unidades import executar_em_cada_armazenamento
+from app.versao_dados import obter_versao
+
+# Série temporal da execução orçamentária.
+# A tabela execucao_diaria guarda, por dia, seção, PI e ND, os valores recebidos (chegada
+# das NCs), empenhados, anulados e recolhidos. É preenchida pelo agendador, de forma
+# incremental: cada escrita em NCs, empenhos, anulações ou recolhimentos (inclusive
+# alterações e exclusões) regista, na mesma transação, a data mais antiga afetada, e a
+# execução seguinte reprocessa a partir dessa data ou do dia seguinte ao último consolidado.
+# As séries acumuladas são calculadas sobre esta tabela com funções de janela.
+
+# Data de cada movimentação e colunas cuja alteração muda a série (a data incluída).
+# Alterar as dimensões de uma NC afeta todas as suas movimentações, a partir da chegada.
+_MOVIMENTACOES = {
+    models.NotaCredito: ("data_chegada", ("valor", "data_chegada", "secao_responsavel_id", "plano_interno", "nd", "unidade_id")),
+    models.Empenho: ("data_empenho", ("valor", "data_empenho", "nota_credito_id")),
+    models.AnulacaoEmpenho: ("data", ("valor", "data", "empenho_id")),
+    models.RecolhimentoSaldo: ("data", ("valor", "data", "nota_credito_id")),
+}
+
+_METRICAS = ("recebido", "empenhado", "anulado", "recolhido")
+
+# Chave do advisory lock que impede duas atualizações simultâneas (PostgreSQL).
+_LOCK_SERIE = 4_002_002
+
+
+@migracao(3, "índices nas datas das movimentações")
+def indexar_datas_movimentacoes(conn: Connection):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_notas_credito_data_chegada ON notas_credito (data_chegada)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_empenhos_data_empenho ON empenhos (data_empenho)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_anulacoes_empenho_data ON anulacoes_empenho (data)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recolhimentos_saldo_data ON recolhimentos_saldo (data)"))
+
+
+@migracao(7, "data pendente de reprocessamento da série temporal")
+def adicionar_pendente_desde(conn: Connection):
+    em_cada_armazenamento(conn, _adicionar_pendente_desde)
+
+
+def _adicionar_pendente_desde(conn: Connection, esquema=None):
+    inspetor = inspect(conn)
+    if not inspetor.has_table("execucao_diaria_controle", schema=esquema):
+        return
+    prefixo = f'"{esquema}".' if esquema else ""
+    if "pendente_desde" not in {c["name"] for c in inspetor.get_columns("execucao_diaria_controle", schema=esquema)}:
+        conn.execute(text(f"ALTER TABLE {prefixo}execucao_diaria_controle ADD COLUMN pendente_desde DATE"))
+    # Alterações retroativas anteriores a esta versão não foram registadas: reconstrói tudo.
+    conn.execute(text(f"UPDATE {prefixo}execucao_diaria_controle SET ultimo_dia = NULL"))
+
+
+def _datas_afetadas(session: Session):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        movimentacao = _MOVIMENTACOES.get(type(obj))
+        if movimentacao is None:
+            continue
+        coluna_data, colunas = movimentacao
+        estado = inspect(obj)
+        if obj in session.dirty and not any(estado.attrs[c].history.has_changes() for c in colunas):
+            continue
+        # Data atual e, se mudou, a anterior; o histórico não carrega atributos expirados.
+        historico = estado.attrs[coluna_data].history
+        yield from (d for d in (*historico.added, *historico.unchanged, *historico.deleted) if d is not None)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _registar_data_pendente(session, flush_context):
+    desde = min(_datas_afetadas(session), default=None)
+    if desde is None:
+        return
+    # Só atualiza quando a data recua, para que escritas concorrentes raramente disputem a linha.
+    C = models.ExecucaoDiariaControle
+    session.execute(
+        update(C).where(C.id == 1, or_(C.pendente_desde.is_(None), C.pendente_desde > desde)).values(pendente_desde=desde),
+        execution_options={"synchronize_session": False},
+    )
+
+
+def _movimentos_desde(inicio: date):
+    # Uma linha por movimentação, já com as dimensões da NC; inclui o arquivo de exercícios.
+    NC, E, A, R = notas_credito_com_arquivo(), empenhos_com_arquivo(), anulacoes_com_arquivo(), recolhimentos_com_arquivo()
+    zero = literal(0)
+    dimensoes = (NC.unidade_id.label("unidade_id"), NC.secao_responsavel_id.label("secao_id"), NC.plano_interno.label("plano_interno"), NC.nd.label("nd"))
+    return union_all(
+        select(NC.data_chegada.label("data"), *dimensoes, NC.valor.label("recebido"), zero.label("empenhado"), zero.label("anulado"), zero.label("recolhido"))
+        .where(NC.data_chegada >= inicio),
+        select(E.data_empenho, *dimensoes, zero, E.valor, zero, zero)
+        .select_from(E).join(NC, E.nota_credito_id == NC.id).where(E.data_empenho >= inicio),
+        select(A.data, *dimensoes, zero, zero, A.valor, zero)
+        .select_from(A).join(E, A.empenho_id == E.id).join(NC, E.nota_credito_id == NC.id).where(A.data >= inicio),
+        select(R.data, *dimensoes, zero, zero, zero, R.valor)
+        .select_from(R).join(NC, R.nota_credito_id == NC.id).where(R.data >= inicio),
+    ).subquery()
+
+
+def atualizar_execucao_diaria(db: Session, desde: Optional[date] = None) -> bool:
+    """
+    Consolida em execucao_diaria os dias ainda não processados e os afetados por escritas
+    retroativas. Com `desde`, reprocessa a partir dessa data. Devolve True se houve
+    reprocessamento. Abrange todas as unidades do armazenamento da sessão. Executa na
+    transação da sessão recebida; o commit fica a cargo de quem chama.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(:chave)"), {"chave": _LOCK_SERIE}).scalar():
+            return False
+
+    hoje = date.today()
+    # A linha fica bloqueada até ao commit: escritas concorrentes que registem uma data
+    # pendente esperam e ficam para a execução seguinte.
+    controle = db.query(models.ExecucaoDiariaControle).filter(models.ExecucaoDiariaControle.id == 1).with_for_update().first()
+    if controle is None:
+        controle = models.ExecucaoDiariaControle(id=1, ultimo_dia=None, pendente_desde=None)
+        db.add(controle)
+    elif desde is None and controle.ultimo_dia == hoje and controle.pendente_desde is None:
+        return False
+
+    if desde is None:
+        if controle.ultimo_dia is None:
+            desde = date.min
+        else:
+            desde = controle.ultimo_dia + timedelta(days=1)
+            if controle.pendente_desde is not None:
+                desde = min(desde, controle.pendente_desde)
+
+    movimentos = _movimentos_desde(desde)
+    dimensoes = ["data", "unidade_id", "secao_id", "plano_interno", "nd"]
+    agregado = select(
+        *[movimentos.c[d] for d in dimensoes], *[func.sum(movimentos.c[m]) for m in _METRICAS]
+    ).where(movimentos.c.data.is_not(None)).group_by(*[movimentos.c[d] for d in dimensoes])
+
+    todas = {"todas_unidades": True}
+    db.execute(delete(models.ExecucaoDiaria).where(models.ExecucaoDiaria.data >= desde), execution_options=todas)
+    db.execute(insert(models.ExecucaoDiaria).from_select([*dimensoes, *_METRICAS], agregado), execution_options=todas)
+    controle.ultimo_dia = hoje
+    controle.versao = obter_versao(db)
+    if controle.pendente_desde is not None and controle.pendente_desde >= desde:
+        controle.pendente_desde = None
+    return True
+
+
+def processar_serie_temporal() -> int:
+    """Um ciclo do agendador: o banco principal e, depois, cada unidade com armazenamento próprio."""
+    return executar_em_cada_armazenamento(lambda db: int(atualizar_execucao_diaria(db)), "a série temporal")
+
+
+def consultar_serie(
+    db: Session,
+    agrupar_por: str,
+    data_inicio: date,
+    data_fim: date,
+    secao_responsavel_id: Optional[int] = None,
+    plano_interno: Optional[str] = None,
+    nd: Optional[str] = None,
+) -> list:
+    """Séries diárias acumuladas entre data_inicio e data_fim, uma por valor da dimensão."""
+    stmt = consulta_serie(db, agrupar_por, data_inicio, data_fim, secao_responsavel_id, plano_interno, nd)
+    series = {}
+    for row in db.execute(stmt):
+        ponto = {"data": row.dia, **{m: row._mapping[m] or 0 for m in _METRICAS}}
+        ponto["disponivel"] = ponto["recebido"] - ponto["empenhado"] + ponto["anulado"] - ponto["recolhido"]
+        ponto.update({m: Centavos(ponto[m]).reais for m in (*_METRICAS, "disponivel")})
+        series.setdefault(row.chave, []).append(ponto)
+    return [{"chave": k, "pontos": pontos} for k, pontos in series.items()]
+
+
+def consulta_serie(
+    db: Session,
+    agrupar_por: str,
+    data_inicio: date,
+    data_fim: date,
+    secao_responsavel_id: Optional[int] = None,
+    plano_interno: Optional[str] = None,
+    nd: Optional[str] = None,
+):
+    """O SELECT das séries: uma linha por dia e chave (dia, chave e os acumulados de cada métrica)."""
+    D = models.ExecucaoDiaria
+    chave = {"secao": models.Seção.nome, "plano_interno": D.plano_interno, "nd": D.nd}[agrupar_por]
+
+    # O histórico anterior ao período entra como saldo inicial no primeiro dia.
+    dia = case((D.data < data_inicio, literal(data_inicio, Date)), else_=D.data)
+    diario = select(dia.label("dia"), chave.label("chave"), *[func.sum(D.__table__.c[m]).label(m) for m in _METRICAS]) \
+        .select_from(D).outerjoin(models.Seção, D.secao_id == models.Seção.id) \
+        .where(D.data <= data_fim)
+    if secao_responsavel_id: diario = diario.where(D.secao_id == secao_responsavel_id)
+    if plano_interno: diario = diario.where(D.plano_interno.ilike(f"%{plano_interno}%"))
+    if nd: diario = diario.where(D.nd.ilike(f"%{nd}%"))
+    diario = diario.group_by(dia, chave).subquery()
+
+    # Grade completa (dia x chave) para preencher os dias sem movimentação.
+    calendario = select(literal(data_inicio, Date).label("dia")).cte("calendario", recursive=True)
+    if db.get_bind().dialect.name == "postgresql":
+        proximo_dia = calendario.c.dia + 1
+    else:
+        proximo_dia = func.date(calendario.c.dia, "+1 day")
+    calendario = calendario.union_all(select(proximo_dia).where(calendario.c.dia < data_fim))
+    chaves = select(diario.c.chave).distinct().subquery()
+    grade = select(calendario.c.dia, chaves.c.chave).select_from(calendario.join(chaves, true())).subquery()
+
+    acumulados = [
+        func.sum(func.coalesce(diario.c[m], 0)).over(partition_by=grade.c.chave, order_by=grade.c.dia).label(m)
+        for m in _METRICAS
+    ]
+    stmt = select(grade.c.dia, grade.c.chave, *acumulados).select_from(
+        grade.outerjoin(diario, (diario.c.dia == grade.c.dia) & (diario.c.chave == grade.c.chave))
+    ).order_by(grade.c.chave, grade.c.dia)
+    return stmt
@@ -0,0 +1,122 @@
+import glob
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.arquivamento import (anulacoes_com_arquivo, empenhos_com_arquivo,
+                              notas_credito_com_arquivo, recolhimentos_com_arquivo)
+from app.database import unidade_atual
+from app.dinheiro import Dinheiro
+from app.versao_dados import obter_versao
+
+# Exportação colunar (Parquet ou Arrow IPC) das tabelas do razão, para análise em notebooks.
+# Cada tabela é lida em lotes com cursor no servidor (stream_results) e escrita lote a lote,
+# com tipos explícitos e compressão zstd; os valores monetários seguem como decimal(18, 2).
+# O ficheiro fica em disco, identificado pela versão dos dados: pedidos repetidos sem
+# alterações entretanto são um simples envio de ficheiro.
+
+# Por omissão no diretório temporário: na Vercel só /tmp aceita escrita.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "snapshots"))
+SNAPSHOT_LOTE = int(os.getenv("SNAPSHOT_LOTE", "10000"))
+
+FORMATOS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+# Tabela exportada -> (modelo, entidade com o arquivo de exercícios anteriores).
+TABELAS = {
+    "notas_credito": (models.NotaCredito, notas_credito_com_arquivo),
+    "empenhos": (models.Empenho, empenhos_com_arquivo),
+    "anulacoes": (models.AnulacaoEmpenho, anulacoes_com_arquivo),
+    "recolhimentos": (models.RecolhimentoSaldo, recolhimentos_com_arquivo),
+    "secoes": (models.Seção, None),
+}
+
+
+def _tipo_arrow(coluna) -> pa.DataType:
+    if isinstance(coluna.type, Dinheiro):
+        return pa.decimal128(18, 2)
+    if isinstance(coluna.type, Integer):
+        return pa.int64()
+    if isinstance(coluna.type, Float):
+        return pa.float64()
+    if isinstance(coluna.type, DateTime):
+        return pa.timestamp("us")
+    if isinstance(coluna.type, Date):
+        return pa.date32()
+    if isinstance(coluna.type, Boolean):
+        return pa.bool_()
+    return pa.string()
+
+
+def _consulta(tabela: str, incluir_arquivo: bool):
+    modelo, com_arquivo = TABELAS[tabela]
+    entidade = com_arquivo() if incluir_arquivo and com_arquivo else modelo
+    colunas = list(modelo.__table__.columns)
+    stmt = select(*[getattr(entidade, c.name) for c in colunas])
+    # Anulações e recolhimentos são filtrados pela unidade através do registo pai.
+    if modelo is models.AnulacaoEmpenho:
+        E = empenhos_com_arquivo() if incluir_arquivo else models.Empenho
+        stmt = stmt.join(E, entidade.empenho_id == E.id)
+    elif modelo is models.RecolhimentoSaldo:
+        NC = notas_credito_com_arquivo() if incluir_arquivo else models.NotaCredito
+        stmt = stmt.join(NC, entidade.nota_credito_id == NC.id)
+    schema = pa.schema([pa.field(c.name, _tipo_arrow(c), nullable=c.nullable) for c in colunas])
+    return stmt.order_by(entidade.id), schema
+
+
+def _escrever(db: Session, tabela: str, formato: str, incluir_arquivo: bool, caminho: str):
+    stmt, schema = _consulta(tabela, incluir_arquivo)
+    if formato == "parquet":
+        escritor = pq.ParquetWriter(caminho, schema, compression="zstd")
+    else:
+        escritor = pa.ipc.new_file(caminho, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+    try:
+        resultado = db.execute(stmt, execution_options={"stream_results": True, "yield_per": SNAPSHOT_LOTE})
+        for linhas in resultado.partitions():
+            colunas = list(zip(*linhas))
+            # Centavos -> reais exatos nas colunas decimais.
+            colunas = [
+                [v if v is None else v.reais for v in valores] if pa.types.is_decimal(campo.type) else valores
+                for valores, campo in zip(colunas, schema)
+            ]
+            escritor.write_batch(pa.record_batch(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(colunas, schema)], schema=schema
+            ))
+    finally:
+        escritor.close()
+
+
+def obter_snapshot(db: Session, tabela: str, formato: str = "parquet", incluir_arquivo: bool = False) -> str:
+    """Caminho do ficheiro da tabela na versão atual dos dados, gerando-o se ainda não existir."""
+    unidade = unidade_atual.get()
+    prefixo = f"{tabela}{'_com_arquivo' if incluir_arquivo else ''}_u{unidade.id if unidade else 'todas'}"
+    caminho = os.path.join(SNAPSHOT_DIR, f"{prefixo}_v{obter_versao(db)}.{formato}")
+    if os.path.exists(caminho):
+        return caminho
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    # Escreve num temporário e renomeia: outro worker nunca vê um ficheiro incompleto.
+    descritor, temporario = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix=".tmp")
+    os.close(descritor)
+    try:
+        _escrever(db, tabela, formato, incluir_arquivo, temporario)
+        os.replace(temporario, caminho)
+    except Exception:
+        os.remove(temporario)
+        raise
+
+    # Remove as versões anteriores da mesma exportação.
+    for antigo in glob.glob(os.path.join(SNAPSHOT_DIR, f"{prefixo}_v*.{formato}")):
+        if antigo != caminho:
+            try:
+                os.remove(antigo)
+            except OSError:
+                pass
+    return caminho
@@ -0,0 +1,67 @@
+import json
+import os
+
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.orm import Query, Session
+
+from app import models
+
+# Modo NDJSON das listagens (Accept: application/x-ndjson).
+# As linhas são lidas em lotes de um cursor no servidor (yield_per) e cada uma é serializada
+# e enviada de imediato, uma por linha. A última linha traz os metadados da listagem, com
+# "completo": false se a leitura falhou a meio. Sem "size", a listagem é enviada inteira
+# (só a administradores e a utilizadores de todas as unidades; os restantes recebem no
+# máximo TAMANHO_MAXIMO linhas): a memória do servidor e o tempo até à primeira linha já
+# não dependem do tamanho da página.
+
+MEDIA_NDJSON = "application/x-ndjson"
+NDJSON_LOTE = int(os.getenv("NDJSON_LOTE", "500"))
+TAMANHO_MAXIMO = 1000
+
+RESPOSTA_NDJSON = {200: {"content": {MEDIA_NDJSON: {}}, "description": "Uma linha JSON por registo, seguida de uma linha {\"_meta\": ...}"}}
+
+
+def aceita_ndjson(request: Request) -> bool:
+    return MEDIA_NDJSON in request.headers.get("accept", "")
+
+
+def pode_transmitir_tudo(user: models.User) -> bool:
+    return user.role == models.UserRole.ADMINISTRADOR or user.unidade_id is None
+
+
+def tamanho_da_pagina(request: Request, user: models.User, size: Optional[int]) -> Optional[int]:
+    """Tamanho efetivo da página; None envia a listagem inteira (NDJSON, utilizadores autorizados)."""
+    completa = pode_transmitir_tudo(user)
+    if aceita_ndjson(request):
+        if completa:
+            return size
+        size = size or TAMANHO_MAXIMO
+    size = size or 10
+    if size > TAMANHO_MAXIMO:
+        dica = " Use Accept: application/x-ndjson para listagens maiores." if completa else ""
+        raise HTTPException(status_code=422, detail=f"O tamanho máximo da página é {TAMANHO_MAXIMO}.{dica}")
+    return size
+
+
+def resposta_ndjson(db: Session, query: Query, schema: type[BaseModel], metadados: dict) -> StreamingResponse:
+    def gerar():
+        linhas = 0
+        completo = True
+        try:
+            for obj in query.yield_per(NDJSON_LOTE):
+                yield schema.model_validate(obj).model_dump_json() + "\n"
+                linhas += 1
+        except Exception as e:
+            # O status HTTP já foi enviado: a falha vai na linha de metadados.
+            completo = False
+            print(f"Falha na transmissão NDJSON após {linhas} linha(s): {e}")
+        finally:
+            # A sessão é fechada aqui, depois da última linha, e não pela dependência.
+            db.close()
+        yield json.dumps({"_meta": {**metadados, "linhas": linhas, "completo": completo}}) + "\n"
+
+    return StreamingResponse(gerar(), media_type=MEDIA_NDJSON)
@@ -0,0 +1,210 @@
+import os
+from typing import Callable, Optional
+
+from sqlalchemy import event, inspect, or_, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session, with_loader_criteria
+
+from app import models
+from app.database import Base, SessaoPorUnidade, SessionLocal, UnidadeContexto, engine, engine_da_unidade, unidade_atual
+from app.migracoes import em_cada_armazenamento, is_postgres, migracao
+
+# Multiunidade.
+# Cada pedido autenticado corre no contexto da unidade do utilizador (ou da indicada no
+# cabeçalho X-Unidade, para utilizadores sem unidade). Todas as consultas ORM recebem
+# automaticamente o filtro unidade_id = <unidade> nos modelos abaixo, e os novos registos
+# recebem a unidade do contexto. Para ignorar o filtro (rotinas globais), usar a opção
+# de execução todas_unidades=True.
+
+MODELOS_FILTRADOS = (
+    models.User,
+    models.Seção,
+    models.NotaCredito,
+    models.Empenho,
+    models.AuditLog,
+    models.NotaCreditoArquivo,
+    models.EmpenhoArquivo,
+    models.ExecucaoDiaria,
+)
+
+# Utilizadores e eventos de auditoria sem unidade são globais; os restantes registos
+# pertencem sempre a uma unidade.
+MODELOS_GLOBAIS_PERMITIDOS = (models.User, models.AuditLog)
+
+_cache_unidades = {}
+
+
+class UnidadeNaoIndicada(Exception):
+    pass
+
+
+def modelos_por_unidade() -> list:
+    return [m.class_ for m in Base.registry.mappers if getattr(m.class_, "__por_unidade__", False)]
+
+
+def carregar_unidade(db: Session, unidade_id: int) -> Optional[UnidadeContexto]:
+    if unidade_id not in _cache_unidades:
+        unidade = db.get(models.Unidade, unidade_id)
+        if unidade is None:
+            return None
+        _cache_unidades[unidade_id] = UnidadeContexto(unidade.id, unidade.esquema, unidade.database_url)
+    return _cache_unidades[unidade_id]
+
+
+def definir_unidade(unidade: Optional[UnidadeContexto]):
+    unidade_atual.set(unidade)
+
+
+def esquecer_unidade(unidade_id: int):
+    _cache_unidades.pop(unidade_id, None)
+
+
+def executar_em_cada_armazenamento(rotina: Callable[[Session], int], descricao: str) -> int:
+    """
+    Executa rotina(db) no banco principal e, depois, em cada unidade com armazenamento
+    próprio, com um commit por armazenamento. A falha num não impede os seguintes.
+    Devolve a soma dos resultados.
+    """
+    contextos = [None]
+    db = SessionLocal()
+    try:
+        unidades = db.query(models.Unidade).filter(
+            or_(models.Unidade.esquema.is_not(None), models.Unidade.database_url.is_not(None))
+        ).all()
+        contextos += [UnidadeContexto(u.id, u.esquema, u.database_url) for u in unidades]
+    finally:
+        db.close()
+
+    total = 0
+    for unidade in contextos:
+        db = SessionLocal()
+        if unidade is not None:
+            db.info["unidade"] = unidade
+        try:
+            total += rotina(db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Falha ao processar {descricao}{f' da unidade {unidade.id}' if unidade else ''}: {e}")
+        finally:
+            db.close()
+    return total
+
+
+def preparar_armazenamento(unidade: UnidadeContexto):
+    # Cria o schema/banco próprio da unidade com as tabelas que lá residem.
+    bind = engine_da_unidade(unidade)
+    if bind is None:
+        return
+    if unidade.schema and bind.dialect.name == "postgresql":
+        with bind.begin() as conn:
+            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{unidade.schema}"'))
+    Base.metadata.create_all(bind=bind, tables=[m.__table__ for m in modelos_por_unidade()])
+
+
+def restringir_a_unidade(stmt, unidade_id: int):
+    """Aplica a stmt o filtro unidade_id = <unidade> em todos os MODELOS_FILTRADOS."""
+    for modelo in MODELOS_FILTRADOS:
+        stmt = stmt.options(with_loader_criteria(modelo, lambda cls: cls.unidade_id == unidade_id, include_aliases=True))
+    return stmt
+
+
+def _unidade_da_sessao(session: Session) -> Optional[UnidadeContexto]:
+    return session.info.get("unidade", unidade_atual.get())
+
+
+@event.listens_for(SessaoPorUnidade, "do_orm_execute")
+def _filtrar_por_unidade(orm_execute_state):
+    if not (orm_execute_state.is_select or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if orm_execute_state.is_column_load or orm_execute_state.is_relationship_load:
+        return
+    if orm_execute_state.execution_options.get("todas_unidades", False):
+        return
+    unidade = _unidade_da_sessao(orm_execute_state.session)
+    if unidade is None:
+        return
+    orm_execute_state.statement = restringir_a_unidade(orm_execute_state.statement, unidade.id)
+
+
+@event.listens_for(SessaoPorUnidade, "before_flush")
+def _atribuir_unidade(session, flush_context, instances):
+    unidade = _unidade_da_sessao(session)
+    for obj in session.new:
+        if not isinstance(obj, MODELOS_FILTRADOS) or obj.unidade_id is not None:
+            continue
+        if unidade is not None:
+            obj.unidade_id = unidade.id
+        elif not isinstance(obj, MODELOS_GLOBAIS_PERMITIDOS):
+            # Os routers exigem a unidade antes (get_current_user_com_unidade); isto impede o resto.
+            raise UnidadeNaoIndicada(f"{type(obj).__name__} criado sem unidade de trabalho.")
+
+
+UNIDADE_PADRAO_SIGLA = os.getenv("UNIDADE_PADRAO_SIGLA", "2º CGEO")
+UNIDADE_PADRAO_NOME = os.getenv("UNIDADE_PADRAO_NOME", "2º Centro de Geoinformação")
+CABECALHO_PADRAO = "MINISTÉRIO DA DEFESA<br/>EXÉRCITO BRASILEIRO<br/>2º CENTRO DE GEOINFORMAÇÃO"
+
+_TABELAS_COM_UNIDADE = (
+    "users", "secoes", "notas_credito", "empenhos", "audit_logs",
+    "notas_credito_arquivo", "empenhos_arquivo", "audit_logs_arquivo", "execucao_diaria",
+)
+
+
+@migracao(4, "coluna unidade_id, índices por unidade e unidade padrão")
+def adicionar_unidades(conn: Connection):
+    inspetor = inspect(conn)
+    for tabela in _TABELAS_COM_UNIDADE:
+        if "unidade_id" not in {c["name"] for c in inspetor.get_columns(tabela)}:
+            referencia = " REFERENCES unidades (id)" if tabela == "users" else ""
+            conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN unidade_id INTEGER{referencia}"))
+
+    for indice in (
+        "ix_users_unidade_id ON users (unidade_id)",
+        "ix_notas_credito_unidade_data_chegada ON notas_credito (unidade_id, data_chegada)",
+        "ix_notas_credito_unidade_status ON notas_credito (unidade_id, status)",
+        "ix_empenhos_unidade_data_empenho ON empenhos (unidade_id, data_empenho)",
+        "ix_audit_logs_unidade_timestamp ON audit_logs (unidade_id, \"timestamp\")",
+        "ix_notas_credito_arquivo_unidade_id ON notas_credito_arquivo (unidade_id)",
+        "ix_empenhos_arquivo_unidade_id ON empenhos_arquivo (unidade_id)",
+        "ix_audit_logs_arquivo_unidade_id ON audit_logs_arquivo (unidade_id)",
+        "ix_execucao_diaria_unidade_data ON execucao_diaria (unidade_id, data)",
+    ):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {indice}"))
+
+    # O nome da seção passa a ser único por unidade (no SQLite a restrição antiga mantém-se).
+    if is_postgres(conn):
+        conn.execute(text("ALTER TABLE secoes DROP CONSTRAINT IF EXISTS secoes_nome_key"))
+        conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_secoes_unidade_nome ON secoes (unidade_id, nome)"))
+    _numeros_unicos_por_unidade(conn)
+
+    # Os dados existentes passam a pertencer à unidade padrão; os administradores existentes
+    # ficam sem unidade, para poderem gerir as unidades.
+    if conn.execute(text("SELECT COUNT(*) FROM unidades")).scalar() == 0:
+        conn.execute(models.Unidade.__table__.insert().values(
+            sigla=UNIDADE_PADRAO_SIGLA, nome=UNIDADE_PADRAO_NOME, cabecalho=CABECALHO_PADRAO
+        ))
+    unidade_padrao = conn.execute(text("SELECT MIN(id) FROM unidades")).scalar()
+    for tabela in _TABELAS_COM_UNIDADE:
+        condicao = " AND role <> 'ADMINISTRADOR'" if tabela == "users" else ""
+        conn.execute(text(f"UPDATE {tabela} SET unidade_id = :unidade WHERE unidade_id IS NULL{condicao}"), {"unidade": unidade_padrao})
+
+
+def _numeros_unicos_por_unidade(conn: Connection, esquema=None):
+    # Os números de NC e de NE passam a ser únicos por unidade: o índice único antigo
+    # (de todas as unidades) denunciava números já usados noutras unidades.
+    inspetor = inspect(conn)
+    prefixo = f'"{esquema}".' if esquema else ""
+    for tabela, coluna in (("notas_credito", "numero_nc"), ("empenhos", "numero_ne")):
+        if not inspetor.has_table(tabela, schema=esquema):
+            continue
+        indice = f"ix_{tabela}_{coluna}"
+        if not any(i["name"] == indice and i["unique"] for i in inspetor.get_indexes(tabela, schema=esquema)):
+            continue
+        conn.execute(text(f"DROP INDEX {prefixo}{indice}"))
+        conn.execute(text(f"CREATE INDEX {indice} ON {prefixo}{tabela} ({coluna})"))
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{tabela}_unidade_{coluna} ON {prefixo}{tabela} (unidade_id, {coluna})"))
+
+
+@migracao(8, "números de NC e de NE únicos por unidade")
+def numeros_unicos_por_unidade(conn: Connection):
+    em_cada_armazenamento(conn, _numeros_unicos_por_unidade)
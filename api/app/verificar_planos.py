@@ -0,0 +1,41 @@
+import argparse
+import sys
+from typing import List, Optional
+
+from app.database import Base, engine
+from app.migracoes import aplicar_migracoes
+from app.particoes_auditoria import garantir_particoes
+from app.planos_consulta import CUSTO_MAXIMO, CUSTO_MAXIMO_AGREGACOES, popular_dados_sinteticos, verificar_planos
+
+# Verificação dos planos de execução das consultas principais, para correr no CI ou
+# antes de uma publicação:
+#
+#   python -m app.verificar_planos --popular 50000
+#
+# Com --popular, preenche um banco vazio com dados sintéticos antes da verificação
+# (nunca usar no banco de produção). Termina com código 1 se algum plano regrediu.
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Verifica os planos de execução das consultas principais.")
+    parser.add_argument("--popular", type=int, metavar="N", help="gera N NCs sintéticas (banco vazio) antes da verificação")
+    parser.add_argument("--custo-maximo", type=float, default=CUSTO_MAXIMO, help="orçamento de custo por consulta (PostgreSQL)")
+    parser.add_argument("--custo-maximo-agregacoes", type=float, default=CUSTO_MAXIMO_AGREGACOES, help="orçamento de custo por agregação do painel e dos relatórios (PostgreSQL)")
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+    aplicar_migracoes(engine)
+    garantir_particoes(engine)
+    if args.popular:
+        popular_dados_sinteticos(engine, args.popular)
+
+    with engine.connect() as conn:
+        resultados = verificar_planos(conn, args.custo_maximo, args.custo_maximo_agregacoes)
+    for r in resultados:
+        custo = f"{r['custo']:10.1f}" if r["custo"] is not None else " " * 10
+        print(f"{'FALHA' if r['problemas'] else 'OK':5} {custo}  {r['consulta']}  {'; '.join(r['problemas'])}")
+    return 1 if any(r["problemas"] for r in resultados) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
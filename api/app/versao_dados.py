@@ -0,0 +1,72 @@
+from sqlalchemy import event, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import SessionLocal, engine
+from app.migracoes import migracao
+
+# Versão global dos dados financeiros.
+# Serve de chave para os caches de relatórios: qualquer commit que altere NCs, empenhos,
+# anulações, recolhimentos ou seções incrementa a versão, invalidando os resultados anteriores.
+# O incremento acontece depois do commit, numa transação própria e curta, para não
+# serializar as escritas; um leitor que leia a versão antiga nesse intervalo apenas
+# guarda um resultado sob uma chave que já não será consultada.
+
+MODELOS_VERSIONADOS = (
+    models.Seção,
+    models.NotaCredito,
+    models.Empenho,
+    models.AnulacaoEmpenho,
+    models.RecolhimentoSaldo,
+    models.NotaCreditoArquivo,
+    models.EmpenhoArquivo,
+    models.AnulacaoEmpenhoArquivo,
+    models.RecolhimentoSaldoArquivo,
+)
+
+_CHAVE_ALTERADO = "dados_financeiros_alterados"
+
+
+@migracao(2, "linha inicial de versao_dados")
+def criar_versao_inicial(conn: Connection):
+    if conn.execute(select(models.VersaoDados.id).where(models.VersaoDados.id == 1)).first() is None:
+        conn.execute(models.VersaoDados.__table__.insert().values(id=1, versao=0))
+
+
+def obter_versao(db: Session) -> int:
+    return db.execute(select(models.VersaoDados.versao).where(models.VersaoDados.id == 1)).scalar() or 0
+
+
+def incrementar_versao():
+    with engine.begin() as conn:
+        conn.execute(update(models.VersaoDados).where(models.VersaoDados.id == 1).values(versao=models.VersaoDados.versao + 1))
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _marcar_alteracoes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, MODELOS_VERSIONADOS):
+            session.info[_CHAVE_ALTERADO] = True
+            return
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _marcar_alteracoes_em_massa(orm_execute_state):
+    # INSERT/UPDATE/DELETE em massa (ex.: arquivamento) não passam pelo flush.
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, MODELOS_VERSIONADOS):
+        orm_execute_state.session.info[_CHAVE_ALTERADO] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _incrementar_apos_commit(session):
+    if session.info.pop(_CHAVE_ALTERADO, False):
+        incrementar_versao()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _descartar_marcacao(session):
+    session.info.pop(_CHAVE_ALTERADO, None)
@@ -1,7 +1,7 @@
 import sys
 import os
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Request
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
@@ -9,7 +9,12 @@ from dotenv import load_dotenv
 sys.path.insert(0, os.path.dirname(__file__))
 
 # As importações agora são absolutas a partir da pasta 'app'
-from app.database import engine, Base
+from app.database import engine, Base, fixar_no_primario, replicas
+from app.fila_auditoria import AUDIT_WRITE_BEHIND, fila_auditoria
+from app.migracoes import aplicar_migracoes
+from app.particoes_auditoria import garantir_particoes
+from app.agendador import AGENDADOR_ATIVO, agendador
+from app import relatorio_pdf
 from app.routers import autenticacao, administracao, notas_credito, empenhos, dashboard, relatorios, auditoria
 
 load_dotenv()
@@ -20,8 +25,21 @@ async def lifespan(app: FastAPI):
     # Isto agora só acontece no arranque, quando as variáveis de ambiente estão disponíveis.
     Base.metadata.create_all(bind=engine)
     print("Tabelas verificadas/criadas com sucesso.")
+    aplicar_migracoes(engine)
+    garantir_particoes(engine)
+    print("Migrações aplicadas e partições de auditoria verificadas.")
+    if AUDIT_WRITE_BEHIND:
+        fila_auditoria.start()
+        print("Fila de auditoria (write-behind) iniciada.")
+    if AGENDADOR_ATIVO:
+        agendador.start()
+        print("Agendador de rotinas (prazos das NCs, série temporal, partições de auditoria) iniciado.")
     yield
     print("Aplicação a desligar.")
+    agendador.stop()
+    relatorio_pdf.encerrar()
+    # Grava os eventos de auditoria pendentes antes de encerrar.
+    fila_auditoria.stop()
 
 app = FastAPI(
     title="Sistema de Gestão de Notas de Crédito",
@@ -38,6 +56,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def leitura_apos_escrita(request: Request, call_next):
+    # Após uma escrita bem-sucedida, as leituras do mesmo cliente vão ao primário por alguns segundos.
+    response = await call_next(request)
+    if (replicas.sessoes and request.method in ("POST", "PUT", "PATCH", "DELETE")
+            and response.status_code < 400 and not request.url.path.endswith("/token")):
+        fixar_no_primario(response)
+    return response
+
 # CORREÇÃO: O prefixo /api foi removido daqui, pois a Vercel já o adiciona.
 # Esta é a única alteração funcional no código.
 api_router = APIRouter()
@@ -0,0 +1,83 @@
+"""
+Encaminhamento das leituras para as réplicas, com ficheiros SQLite no lugar de duas
+instâncias PostgreSQL: cada banco identifica-se numa tabela própria, pelo que a
+leitura mostra de onde veio.
+
+    cd api && python -m pytest tests
+"""
+import os
+import sqlite3
+import tempfile
+import time
+
+_DIR = tempfile.mkdtemp(prefix="salc_replicas_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DIR, 'primario.db')}"
+
+import pytest
+from sqlalchemy import text
+from starlette.requests import Request
+
+from app import database
+
+
+def _banco(nome: str) -> str:
+    caminho = os.path.join(_DIR, f"{nome}.db")
+    with sqlite3.connect(caminho) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS origem (nome TEXT)")
+        conn.execute("DELETE FROM origem")
+        conn.execute("INSERT INTO origem VALUES (?)", (nome,))
+    return f"sqlite:///{caminho}"
+
+
+def _origem(db) -> str:
+    return db.execute(text("SELECT nome FROM origem")).scalar()
+
+
+def _pedido(cookies: str = "") -> Request:
+    headers = [(b"cookie", cookies.encode())] if cookies else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def _ler(request: Request) -> str:
+    dependencia = database.get_read_db(request)
+    db = next(dependencia)
+    try:
+        return _origem(db)
+    finally:
+        dependencia.close()
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    _banco("primario")
+    instalar = lambda urls: monkeypatch.setattr(database, "replicas", database._Replicas(urls))
+    return instalar
+
+
+def test_round_robin_entre_as_replicas(replicas):
+    replicas([_banco("replica1"), _banco("replica2")])
+    assert [_ler(_pedido()) for _ in range(4)] == ["replica1", "replica2", "replica1", "replica2"]
+
+
+def test_replica_indisponivel_e_saltada(replicas):
+    replicas([_banco("replica1"), f"sqlite:///{os.path.join(_DIR, 'inexistente', 'replica2.db')}"])
+    assert [_ler(_pedido()) for _ in range(4)] == ["replica1"] * 4
+    assert database.replicas._indisponivel_ate[1] > time.monotonic()
+
+
+def test_sem_replicas_saudaveis_le_do_primario(replicas):
+    replicas([f"sqlite:///{os.path.join(_DIR, 'inexistente', 'replica.db')}"])
+    assert _ler(_pedido()) == "primario"
+
+
+def test_cliente_que_escreveu_le_do_primario(replicas):
+    replicas([_banco("replica1"), _banco("replica2")])
+    ate = f"{time.time() + database.READ_PIN_SECONDS:.0f}"
+    assert _ler(_pedido(f"{database.COOKIE_LEITURA_PRIMARIO}={ate}")) == "primario"
+    # Expirada a fixação, volta às réplicas.
+    assert _ler(_pedido(f"{database.COOKIE_LEITURA_PRIMARIO}={time.time() - 1:.0f}")) == "replica1"
+
+
+def test_timeout_de_ligacao_so_no_postgresql():
+    assert database._argumentos_ligacao("postgresql://replica/db") == {"connect_timeout": database.REPLICA_CONNECT_TIMEOUT}
+    assert database._argumentos_ligacao("sqlite:///replica.db") == {}
@@ -168,7 +168,7 @@
                             <div class="filter-group"><label for="report-filter-pi">Plano Interno</label><input type="text" id="report-filter-pi" placeholder="Ex: 2024NE123456"></div>
                             <div class="filter-group"><label for="report-filter-nd">Natureza de Despesa</label><input type="text" id="report-filter-nd" placeholder="Ex: 339030"></div>
                             <div class="filter-group"><label for="report-filter-secao">Seção Responsável</label><select id="report-filter-secao"><option value="">Todas</option></select></div>
-                            <div class="filter-group"><label for="report-filter-status">Status</label><select id="report-filter-status"><option value="">Todos</option><option value="Ativa">Ativa</option><option value="Totalmente Empenhada">Totalmente Empenhada</option><option value="Recolhida">Recolhida</option></select></div>
+                            <div class="filter-group"><label for="report-filter-status">Status</label><select id="report-filter-status"><option value="">Todos</option><option value="Ativa">Ativa</option><option value="Totalmente Empenhada">Totalmente Empenhada</option><option value="Recolhida">Recolhida</option><option value="Vencida">Vencida</option></select></div>
                             <button id="generate-report-pdf-btn" class="btn btn-primary" style="margin-left: 1rem;"><i class="fas fa-file-pdf"></i> Gerar PDF</button>
                         </div>
                         <div class="form-field" style="margin-top: 1rem;"><input type="checkbox" id="report-incluir-detalhes" name="incluir-detalhes"><label for="report-incluir-detalhes" style="display: inline-block; margin-left: 0.5rem;">Incluir detalhes de empenhos e recolhimentos</label></div>
@@ -228,7 +228,7 @@
                                 <input type="search" id="search-nc" placeholder="Buscar por Nº da NC, PI ou ND...">
                             </div>
                             <div class="filter-group"><label for="filter-secao">Seção Responsável</label><select id="filter-secao"><option value="">Todas</option></select></div>
-                            <div class="filter-group"><label for="filter-status">Status</label><select id="filter-status"><option value="">Todos</option><option value="Ativa">Ativa</option><option value="Totalmente Empenhada">Totalmente Empenhada</option><option value="Recolhida">Recolhida</option></select></div>
+                            <div class="filter-group"><label for="filter-status">Status</label><select id="filter-status"><option value="">Todos</option><option value="Ativa">Ativa</option><option value="Totalmente Empenhada">Totalmente Empenhada</option><option value="Recolhida">Recolhida</option><option value="Vencida">Vencida</option></select></div>
                             <button id="apply-filters-btn" class="btn">Aplicar Filtros</button>
                         </div>
                     </div>